@@ -0,0 +1,165 @@
+import asyncio
+
+from discord import TextChannel, PartialEmoji
+
+from bot.utils import UPVOTE, DOWNVOTE
+
+# First snowflake of the synthetic messages, 2021-01-01.
+FIRST_SNOWFLAKE = 790000000000000000
+
+
+# In-process stand-ins for the parts of discord.py the bot uses. Every REST
+# call is a no-op that only counts itself, optionally after a fixed latency.
+class FakeGateway:
+
+    def __init__(self, rest_latency=0.0):
+        self.rest_latency = rest_latency
+        self.rest_calls = 0
+        self.next_snowflake = FIRST_SNOWFLAKE
+
+    def snowflake(self):
+        # Discord snowflakes leave the lowest 22 bits to worker and sequence.
+        self.next_snowflake += 1 << 22
+        return self.next_snowflake
+
+    async def rest(self):
+        self.rest_calls += 1
+        if self.rest_latency:
+            await asyncio.sleep(self.rest_latency)
+
+
+class FakeUser:
+
+    def __init__(self, gateway, name):
+        self.gateway = gateway
+        self.id = gateway.snowflake()
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+    async def create_dm(self):
+        await self.gateway.rest()
+        return FakeDMChannel(self.gateway, self)
+
+
+class FakeDMChannel:
+
+    def __init__(self, gateway, user):
+        self.gateway = gateway
+        self.id = gateway.snowflake()
+        self.recipient = user
+
+    async def send(self, content=None, **kwargs):
+        await self.gateway.rest()
+
+
+class FakeReaction:
+
+    def __init__(self, emoji, count):
+        self.emoji = emoji
+        self.count = count
+
+
+class FakeMessage:
+
+    def __init__(self, gateway, channel, author, content, up_votes=0, down_votes=0):
+        self.gateway = gateway
+        self.id = gateway.snowflake()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.type = 0
+        self.reactions = [FakeReaction(UPVOTE, up_votes), FakeReaction(DOWNVOTE, down_votes)]
+
+    async def delete(self):
+        await self.gateway.rest()
+
+    async def edit(self, **kwargs):
+        await self.gateway.rest()
+
+
+class FakeTextChannel(TextChannel):
+    # Subclassed so isinstance checks of the bot pass, the slots of
+    # TextChannel are filled without a ConnectionState.
+
+    def __init__(self, gateway, guild, name):
+        self.gateway = gateway
+        self.id = gateway.snowflake()
+        self.guild = guild
+        self.name = name
+        self.messages = []
+        self.sent = []
+        self.reactions = {}
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, content=None, **kwargs):
+        await self.gateway.rest()
+        message = FakeMessage(self.gateway, self, None, content or '')
+        self.sent.append((content, kwargs))
+        return message
+
+    async def fetch_message(self, message_id):
+        # Every message exists, with the votes the load test gave it.
+        await self.gateway.rest()
+        up_votes, down_votes = self.reactions.get(message_id, (0, 0))
+        message = FakeMessage(self.gateway, self, None, '', up_votes, down_votes)
+        message.id = message_id
+        return message
+
+    def history(self, limit=100, before=None, after=None, around=None, oldest_first=None):
+        messages = self.messages
+        if after is not None:
+            messages = [message for message in messages if message.id > after.id]
+        if before is not None:
+            messages = [message for message in messages if message.id < before.id]
+        if not oldest_first:
+            messages = list(reversed(messages))
+        gateway = self.gateway
+
+        async def pages():
+            for start in range(0, len(messages), 100):
+                await gateway.rest()
+                for message in messages[start:start + 100]:
+                    yield message
+        return pages()
+
+
+class FakeGuild:
+
+    def __init__(self, gateway, channel_names):
+        self.gateway = gateway
+        self.id = gateway.snowflake()
+        self.name = 'benchmark'
+        self.shard_id = 0
+        self.filesize_limit = 8 * 1024 * 1024
+        self.text_channels = [FakeTextChannel(gateway, self, name) for name in channel_names]
+
+    def get_channel(self, channel_id):
+        for channel in self.text_channels:
+            if channel.id == channel_id:
+                return channel
+
+
+class FakeContext:
+
+    def __init__(self, bot, guild, channel, author):
+        self.bot = bot
+        self.guild = guild
+        self.author = author
+        self.prefix = '/'
+        self.message = FakeMessage(guild.gateway, channel, author, '')
+
+
+class FakeReactionPayload:
+
+    def __init__(self, message, emoji, event_type):
+        self.message_id = message.id
+        self.channel_id = message.channel.id
+        self.guild_id = message.guild.id
+        self.user_id = 0
+        self.emoji = PartialEmoji(name=emoji)
+        self.event_type = event_type
@@ -0,0 +1,95 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db, DATABASE_PRAGMAS
+from database.migrations import migrate
+from database.models import Suggestion, STATE_NEW, STATE_ACCEPTED, STATE_DECLINED, chunked
+
+GUILDS = 3
+CHANNELS_PER_GUILD = 4
+
+
+def seed(rows):
+    states = [STATE_NEW, STATE_ACCEPTED, STATE_DECLINED]
+    with db.atomic():
+        for chunk in chunked(range(rows), 100):
+            Suggestion.insert_many([
+                {
+                    'summary': f'suggestion {i}',
+                    'discord_id': 10 ** 17 + i,
+                    'guild_id': i % GUILDS,
+                    'channel_id': i % (GUILDS * CHANNELS_PER_GUILD),
+                    'state': states[i % 3],
+                    'up_votes': random.randint(0, 500),
+                    'down_votes': random.randint(0, 500),
+                }
+                for i in chunk
+            ]).execute()
+
+
+def timed(func, samples):
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.99)] * 1000
+
+
+def drop_indexes():
+    # Returns the SQL to create the dropped indexes again.
+    indexes = db.execute_sql(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'suggestion' AND sql IS NOT NULL"
+    ).fetchall()
+    for name, _ in indexes:
+        db.execute_sql(f'DROP INDEX "{name}"')
+    return [sql for _, sql in indexes]
+
+
+def run_queries(rows, samples):
+    def lookup():
+        Suggestion.get(Suggestion.discord_id == 10 ** 17 + random.randrange(rows))
+
+    def leaderboard():
+        channel_id = random.randrange(GUILDS * CHANNELS_PER_GUILD)
+        list(Suggestion.select().where(
+            Suggestion.guild_id == channel_id % GUILDS,
+            Suggestion.channel_id == channel_id,
+            Suggestion.state == STATE_NEW
+        ).order_by(Suggestion.score.desc(), Suggestion.id.desc()).limit(5))
+
+    return {'lookup': timed(lookup, samples), 'leaderboard': timed(leaderboard, samples)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Suggestion lookup latency without and with the indexes.')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--samples', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db.init(os.path.join(directory, 'benchmark.db'), pragmas=DATABASE_PRAGMAS)
+        with db:
+            migrate()
+            seed(args.rows)
+            index_sql = drop_indexes()
+            before = run_queries(args.rows, args.samples)
+            for sql in index_sql:
+                db.execute_sql(sql)
+            after = run_queries(args.rows, args.samples)
+
+    print(f'{args.rows} rows, {args.samples} samples, times in ms (p50 / p99)')
+    for query in before:
+        print(f'{query:12} before: {before[query][0]:8.3f} / {before[query][1]:8.3f}'
+              f'   after: {after[query][0]:8.3f} / {after[query][1]:8.3f}')
+
+
+if __name__ == '__main__':
+    main()
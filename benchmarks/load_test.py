@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db, DATABASE_PRAGMAS
+from database.migrations import migrate
+from database.models import Suggestion, STATE_NEW, STATE_ACCEPTED, STATE_DECLINED, chunked
+from bot import SuggestionBot
+from bot.commands import show, export, index_channels, trending
+from bot.utils import UPVOTE, DOWNVOTE
+from logger import BotLogger
+
+from fake_discord import FakeGateway, FakeGuild, FakeUser, FakeMessage, FakeContext, FakeReactionPayload
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+WATCH_CHANNELS = ['suggestion', 'ideas', 'feedback']
+SUMMARY_CHANNEL = 'summary'
+INDEX_CHANNEL = 'archive'
+
+
+def seed(guild, rows):
+    # Returns the seeded (discord_id, channel) pairs.
+    channels = [channel for channel in guild.text_channels if channel.name in WATCH_CHANNELS]
+    states = [STATE_NEW] * 6 + [STATE_ACCEPTED] * 2 + [STATE_DECLINED] * 2
+    seeded = []
+    with db.atomic():
+        for chunk in chunked(range(rows), 100):
+            batch = []
+            for _ in chunk:
+                channel = random.choice(channels)
+                discord_id = guild.gateway.snowflake()
+                up_votes, down_votes = random.randint(0, 50), random.randint(0, 20)
+                channel.reactions[discord_id] = (up_votes, down_votes)
+                seeded.append((discord_id, channel))
+                batch.append({
+                    'summary': f'Suggestion number {len(seeded)}',
+                    'discord_id': discord_id,
+                    'channel_id': channel.id,
+                    'guild_id': guild.id,
+                    'state': random.choice(states),
+                    'up_votes': up_votes,
+                    'down_votes': down_votes,
+                })
+            Suggestion.insert_new(batch)
+    return seeded
+
+
+def percentile(latencies, q):
+    if not latencies:
+        return 0.0
+    return sorted(latencies)[min(int(len(latencies) * q), len(latencies) - 1)]
+
+
+async def drive(coroutines, rate):
+    # Dispatches every coroutine as its own task, like discord.py does with
+    # gateway events, at `rate` per second or all at once for rate 0.
+    latencies = []
+
+    async def timed(coroutine, dispatched):
+        await coroutine
+        latencies.append(time.perf_counter() - dispatched)
+
+    tasks = []
+    start = time.perf_counter()
+    for number, coroutine in enumerate(coroutines):
+        if rate:
+            delay = start + number / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.get_running_loop().create_task(timed(coroutine, time.perf_counter())))
+    await asyncio.gather(*tasks)
+    return latencies, time.perf_counter() - start
+
+
+def result(latencies, seconds):
+    return {
+        'operations': len(latencies),
+        'seconds': round(seconds, 4),
+        'throughput': round(len(latencies) / seconds, 2) if seconds else 0.0,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 4),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 4),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def reaction_events(bot, seeded, count):
+    for _ in range(count):
+        discord_id, channel = random.choice(seeded)
+        message = FakeMessage(channel.gateway, channel, None, '')
+        message.id = discord_id
+        emoji = random.choice([UPVOTE, DOWNVOTE, '🎉'])
+        if random.random() < 0.8:
+            yield bot.on_raw_reaction_add(FakeReactionPayload(message, emoji, 'REACTION_ADD'))
+        else:
+            yield bot.on_raw_reaction_remove(FakeReactionPayload(message, emoji, 'REACTION_REMOVE'))
+
+
+def message_events(bot, guild, users, count):
+    channels = [channel for channel in guild.text_channels if channel.name in WATCH_CHANNELS]
+    for number in range(count):
+        channel = random.choice(channels)
+        if random.random() < 0.8:
+            content = f'[Load test suggestion {number}]\nSome details about the suggestion.'
+        else:
+            content = 'A message without a summary. ' * 10
+        yield bot.on_message(FakeMessage(guild.gateway, channel, random.choice(users), content))
+
+
+async def run_job(bot, command):
+    # Commands only queue jobs, a job scenario lasts until they are done.
+    await command
+    await bot.jobs.join()
+
+
+async def run(args):
+    gateway = FakeGateway(rest_latency=args.rest_latency)
+    guild = FakeGuild(gateway, WATCH_CHANNELS + [SUMMARY_CHANNEL, INDEX_CHANNEL, 'general'])
+    users = [FakeUser(gateway, f'user{number}') for number in range(100)]
+    summary_channel = [channel for channel in guild.text_channels if channel.name == SUMMARY_CHANNEL][0]
+    index_channel = [channel for channel in guild.text_channels if channel.name == INDEX_CHANNEL][0]
+
+    started = time.perf_counter()
+    seeded = seed(guild, args.rows)
+    print(f'Seeded {args.rows} suggestions in {time.perf_counter() - started:.1f}s.')
+
+    os.environ['WATCH_CHANNELS'] = ';'.join(WATCH_CHANNELS + [INDEX_CHANNEL])
+    os.environ['SUMMARY_CHANNEL'] = SUMMARY_CHANNEL
+    os.environ.setdefault('LOG_LEVEL', 'ERROR')
+    logger = BotLogger()
+    bot = SuggestionBot(logger, command_prefix='/')
+    # Refetches and reconciliation must not reach the real discord.
+    bot.get_channel = guild.get_channel
+    bot.get_guild = lambda guild_id: guild if guild_id == guild.id else None
+    bot.registry.load_guild(guild)
+    await bot.load_known_suggestions()
+    bot.votes.start(asyncio.get_running_loop())
+    bot.outbound.start(asyncio.get_running_loop())
+    await bot.jobs.start(asyncio.get_running_loop())
+    ctx = FakeContext(bot, guild, summary_channel, users[0])
+    # Starts the job processes, so the first job does not pay for it.
+    await bot.jobs.in_process(len, ())
+
+    scenarios = {}
+    latencies, seconds = await drive(reaction_events(bot, seeded, args.reactions), args.rate)
+    scenarios['reactions'] = result(latencies, seconds)
+    latencies, seconds = await drive([bot.votes.flush()], 0)
+    scenarios['vote_flush'] = result(latencies, seconds)
+    # Waits for the writes the flush queued, so only the compaction is timed.
+    await bot.repository.write(lambda: None)
+    latencies, seconds = await drive([bot.history.compact()], 0)
+    scenarios['vote_compact'] = result(latencies, seconds)
+
+    latencies, seconds = await drive(message_events(bot, guild, users, args.messages), args.rate)
+    scenarios['messages'] = result(latencies, seconds)
+
+    latencies, seconds = await drive(
+        (show.callback(ctx, 'new', random.randint(1, 20)) for _ in range(args.shows)), 0
+    )
+    scenarios['show'] = result(latencies, seconds)
+
+    latencies, seconds = await drive(
+        (trending.callback(ctx, random.choice([1, 24, 168]), 'new') for _ in range(args.shows)), 0
+    )
+    scenarios['trending'] = result(latencies, seconds)
+
+    latencies, seconds = await drive((run_job(bot, export.callback(ctx, 'all', None, 'csv')) for _ in range(args.exports)), 0)
+    scenarios['export'] = result(latencies, seconds)
+
+    for number in range(args.index_messages):
+        index_channel.messages.append(FakeMessage(
+            gateway, index_channel, random.choice(users), f'[Archived suggestion {number}]\nDetails.',
+            random.randint(0, 10), random.randint(0, 10)
+        ))
+    latencies, seconds = await drive([run_job(bot, index_channels.callback(ctx))], 0)
+    scenarios['index'] = result(latencies, seconds)
+    latencies, seconds = await drive([run_job(bot, index_channels.callback(ctx))], 0)
+    scenarios['index_resume'] = result(latencies, seconds)
+
+    await bot.jobs.stop()
+    await bot.votes.stop()
+    await bot.outbound.stop()
+    bot.repository.close()
+    logger.stop()
+    return scenarios
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    print(f"\nCompared to {baseline['commit'][:12]}:")
+    for name, scenario in results['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if not old:
+            continue
+        throughput = scenario['throughput'] / old['throughput'] if old['throughput'] else 0
+        p99 = scenario['p99_ms'] / old['p99_ms'] if old['p99_ms'] else 0
+        print(f'{name:14} throughput x{throughput:.2f}   p99 x{p99:.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the bot against a fake discord gateway.')
+    parser.add_argument('--rows', type=int, default=10000, help='suggestions to seed the database with')
+    parser.add_argument('--reactions', type=int, default=20000)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--shows', type=int, default=200)
+    parser.add_argument('--exports', type=int, default=3)
+    parser.add_argument('--index-messages', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=0, help='events per second, 0 dispatches all at once')
+    parser.add_argument('--rest-latency', type=float, default=0, help='seconds every fake REST call takes')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='JSON file for the results, defaults to results/<commit>-<rows>.json')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+    random.seed(args.seed)
+    # The bot reads deletion_message.txt relative to the working directory.
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    with tempfile.TemporaryDirectory() as directory:
+        db.init(os.path.join(directory, 'benchmark.db'), pragmas=DATABASE_PRAGMAS)
+        with db:
+            migrate()
+        scenarios = asyncio.run(run(args))
+        db.close()
+
+    results = {
+        'commit': current_commit(),
+        'date': datetime.datetime.utcnow().isoformat(),
+        'parameters': vars(args),
+        'scenarios': scenarios,
+    }
+    print(f"{'scenario':14} {'ops':>7} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'rss MB':>7}")
+    for name, scenario in scenarios.items():
+        print(
+            f"{name:14} {scenario['operations']:7} {scenario['throughput']:10.1f} "
+            f"{scenario['p50_ms']:9.3f} {scenario['p99_ms']:9.3f} {scenario['peak_rss_mb']:7.1f}"
+        )
+
+    output = args.output or os.path.join(RESULTS_DIRECTORY, f"{results['commit'][:12]}-{args.rows}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f'Results written to {output}')
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
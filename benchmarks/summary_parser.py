@@ -0,0 +1,63 @@
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.summary import SummaryParser
+
+LEGACY_REGEX = re.compile(r'.*\[(?P<summary>.*)\].*')
+
+# Discord allows messages of up to 4000 characters (with Nitro).
+MESSAGE_LIMIT = 4000
+
+
+def adversarial_inputs(length):
+    return {
+        'valid': '[' + 'a' * 50 + ']\n' + 'details ' * ((length - 53) // 8),
+        'opening brackets': '[' * length,
+        'closing brackets': ']' * length,
+        'alternating': '[]' * (length // 2),
+        'no closing': '[a' * (length // 2),
+        'late summary': 'a' * (length - 10) + '[summary]',
+        'summary on line 2': 'a' * (length // 2) + '\n[' + 'b' * (length // 2 - 3) + ']',
+    }
+
+
+def legacy_parse(content, max_length):
+    match = LEGACY_REGEX.match(content)
+    if not match:
+        return None
+    summary = match.group('summary')
+    return None if len(summary) > max_length else summary
+
+
+def check_equivalence(parser, rounds):
+    alphabet = 'ab[]\n'
+    for _ in range(rounds):
+        content = ''.join(random.choice(alphabet) for _ in range(random.randrange(30)))
+        summary, _ = parser.parse(content)
+        assert summary == legacy_parse(content, parser.max_length), content
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Summary parser against the former SUMMARY_REGEX.')
+    arg_parser.add_argument('--length', type=int, default=MESSAGE_LIMIT)
+    arg_parser.add_argument('--number', type=int, default=20)
+    args = arg_parser.parse_args()
+
+    parser = SummaryParser(max_length=200)
+    check_equivalence(parser, 100000)
+
+    print(f'{args.length} characters, average of {args.number} runs, times in µs')
+    for name, content in adversarial_inputs(args.length).items():
+        legacy = timeit.timeit(lambda: legacy_parse(content, 200), number=args.number) / args.number
+        current = timeit.timeit(lambda: parser.parse(content), number=args.number) / args.number
+        print(f'{name:18} regex: {legacy * 1e6:12.1f}   parser: {current * 1e6:8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,46 @@
 import sys
 import os
-import re
+import logging
 
-from discord.ext.commands import Bot
+from discord import Embed, NotFound, Forbidden
+from discord.ext.commands import Bot, AutoShardedBot
 
-from database.models import Suggestion
+from database import ranking
+from database.models import STATE_NEW
+from database.repository import Repository
+from metrics import metrics, RateLimitHandler, serve as serve_metrics, dump as dump_metrics
 
-SUMMARY_REGEX = r'.*\[(?P<summary>.*)\].*'
+from .utils import get_votes, get_vote_deltas, UPVOTE, DOWNVOTE
+from .votes import VoteBuffer
+from .reconcile import VoteReconciler
+from .known import KnownSuggestions
+from .channels import ChannelRegistry
+from .summary import SummaryParser
+from .leaderboard import LeaderboardCache, render_field
+from .outbound import OutboundQueue
+from .template import MessageTemplate
+from .jobs import JobRunner, rescore_suggestions
+from .history import VoteHistory
 
-from .utils import get_votes, UPVOTE, DOWNVOTE
+# Fields the DELETION_MESSAGE template can use.
+DELETION_FIELDS = {'channel', 'max_length', 'orig_message', 'reason'}
 
+# Most similar suggestions listed when flagging a possible duplicate.
+MAX_FLAGGED_DUPLICATES = 5
 
-class SuggestionBot(Bot):
+# Discord's limit for embed titles and field names.
+MAX_EMBED_TITLE = 256
+
+# Setting holding the ranking algorithm of the stored scores.
+RANKING_SETTING = 'ranking_algorithm'
+
+
+# Everything of the bot, independent of whether it runs as a single
+# connection (SuggestionBot) or with one connection per shard
+# (ShardedSuggestionBot).
+class SuggestionBotMixin:
+
+    sharded = False
 
     def __init__(self, logger, *args, **kwargs):
         logger.debug('Start SuggestionBot.__init__')
@@ -29,9 +58,9 @@ class SuggestionBot(Bot):
                 self.message_template = message_template_file.read()
             self.logger.info('Loaded DELETION_MESSAGE template.')
         except Exception as e:
-            self.logger.critical(f'Could not load message_template {message_template_path}')
-            self.logger.critical(f'Got following error: {e}')
-            self.logger.critical(f'Exiting.')
+            self.logger.critical('Could not load message_template %s', message_template_path)
+            self.logger.critical('Got following error: %s', e)
+            self.logger.critical('Exiting.')
             sys.exit(1)
 
         self.logger.debug('Loading SUMMARY_MAX_LENGTH.')
@@ -39,112 +68,458 @@ class SuggestionBot(Bot):
         if not max_length:
             self.logger.warning('No SUMMARY_MAX_LENGTH defined, falling back to default.')
             max_length = 200
-        self.logger.info(f'Setting summary max length to {max_length}')
-        self.max_length = max_length
+        self.logger.info('Setting summary max length to %s', max_length)
+        self.max_length = int(max_length)
+
+        try:
+            self.deletion_template = MessageTemplate(self.message_template, DELETION_FIELDS, max_length=self.max_length)
+        except ValueError as e:
+            self.logger.critical('Could not parse message_template %s', message_template_path)
+            self.logger.critical('Got following error: %s', e)
+            self.logger.critical('Exiting.')
+            sys.exit(1)
+
+        self.logger.debug('Loading SUMMARY_MIN_LENGTH.')
+        min_length = os.getenv('SUMMARY_MIN_LENGTH')
+        if not min_length:
+            self.logger.warning('No SUMMARY_MIN_LENGTH defined, falling back to default.')
+            min_length = 0
+        self.logger.info('Setting summary min length to %s', min_length)
+        self.min_length = int(min_length)
+
+        self.logger.debug('Loading SUMMARY_BRACKETS.')
+        brackets = os.getenv('SUMMARY_BRACKETS')
+        if not brackets:
+            self.logger.warning('No SUMMARY_BRACKETS defined, falling back to default.')
+            brackets = '[]'
+        self.logger.info("Setting summary brackets to '%s'", brackets)
+        try:
+            self.parser = SummaryParser(self.max_length, min_length=self.min_length, brackets=brackets)
+        except ValueError as e:
+            self.logger.critical('Got following error: %s', e)
+            self.logger.critical('Exiting.')
+            sys.exit(1)
 
         self.logger.debug('Loading WATCH_CHANNELS.')
         channels = os.getenv('WATCH_CHANNELS')
         if not channels:
             self.logger.warning('No WATCH_CHANNELS defined, falling back to default.')
             channels = 'suggestion'
-        self.logger.info(f'Setting channels to watch to {channels}')
+        self.logger.info('Setting channels to watch to %s', channels)
         self.channels = channels.split(';')
 
         self.logger.debug('Loading SUMMARY_CHANNEL')
         self.SUMMARY_CHANNEL = os.getenv('SUMMARY_CHANNEL')
-        self.logger.info(f"Set SUMMARY_CHANNEL to '{self.SUMMARY_CHANNEL}'")
+        self.logger.info("Set SUMMARY_CHANNEL to '%s'", self.SUMMARY_CHANNEL)
+        self.registry = ChannelRegistry(self.channels, self.SUMMARY_CHANNEL)
+
+        self.logger.debug('Loading VOTE_RECONCILE_RATE.')
+        reconcile_rate = os.getenv('VOTE_RECONCILE_RATE')
+        if not reconcile_rate:
+            self.logger.warning('No VOTE_RECONCILE_RATE defined, falling back to default.')
+            reconcile_rate = 50
+        self.logger.info('Reconciling votes with discord every %s reaction events.', reconcile_rate)
+        self.reconcile_rate = int(reconcile_rate)
+        self.reaction_events = 0
+
+        self.logger.debug('Loading RANKING_ALGORITHM.')
+        self.ranking = os.getenv('RANKING_ALGORITHM')
+        if not self.ranking:
+            self.logger.warning('No RANKING_ALGORITHM defined, falling back to default.')
+            self.ranking = ranking.DEFAULT_ALGORITHM
+        if self.ranking not in ranking.ALGORITHMS:
+            self.logger.critical("Unknown RANKING_ALGORITHM '%s', choose one of %s.", self.ranking, ', '.join(ranking.ALGORITHMS))
+            self.logger.critical('Exiting.')
+            sys.exit(1)
+        self.logger.info('Ranking suggestions by %s.', self.ranking)
+        ranking.set_algorithm(self.ranking)
+
+        self.logger.debug('Loading DB_READERS.')
+        readers = os.getenv('DB_READERS')
+        if not readers:
+            self.logger.warning('No DB_READERS defined, falling back to default.')
+            readers = 2
+        self.logger.info('Using %s threads for database reads.', readers)
+        self.repository = Repository(self.logger, readers=int(readers))
+
+        self.known = KnownSuggestions()
+
+        self.logger.debug('Loading VOTE_FLUSH_INTERVAL.')
+        flush_interval = os.getenv('VOTE_FLUSH_INTERVAL')
+        if not flush_interval:
+            self.logger.warning('No VOTE_FLUSH_INTERVAL defined, falling back to default.')
+            flush_interval = 0.5
+        self.logger.info('Writing collected votes every %s seconds.', flush_interval)
+        self.leaderboard = LeaderboardCache(self.repository)
+        self.votes = VoteBuffer(
+            self.logger, self.repository, float(flush_interval),
+            on_drift=self.schedule_refetch, on_flush=self.leaderboard.invalidate
+        )
+
+        self.logger.debug('Loading VOTE_ROLLUP_INTERVAL.')
+        rollup_interval = os.getenv('VOTE_ROLLUP_INTERVAL')
+        if not rollup_interval:
+            self.logger.warning('No VOTE_ROLLUP_INTERVAL defined, falling back to default.')
+            rollup_interval = 300
+        self.logger.debug('Loading VOTE_EVENT_RETENTION_DAYS.')
+        event_retention_days = os.getenv('VOTE_EVENT_RETENTION_DAYS')
+        if not event_retention_days:
+            self.logger.warning('No VOTE_EVENT_RETENTION_DAYS defined, falling back to default.')
+            event_retention_days = 7
+        self.logger.info(
+            'Compacting the vote history every %s seconds, keeping vote events for %s days.', rollup_interval, event_retention_days
+        )
+        self.history = VoteHistory(self.logger, self.repository, float(rollup_interval), float(event_retention_days))
 
-        self.logger.debug('Compiling RegEx')
-        self.check = re.compile(SUMMARY_REGEX)
-        self.logger.info('Setup of RegEx complete.')
+        self.logger.debug('Loading SHOW_SINGLE_EMBED.')
+        self.show_single_embed = os.getenv('SHOW_SINGLE_EMBED', '').lower() in ('1', 'true', 'yes')
+        self.logger.info('Showing all channels in a single message: %s', self.show_single_embed)
+
+        self.logger.debug('Loading RECONCILE_CONCURRENCY.')
+        reconcile_concurrency = os.getenv('RECONCILE_CONCURRENCY')
+        if not reconcile_concurrency:
+            self.logger.warning('No RECONCILE_CONCURRENCY defined, falling back to default.')
+            reconcile_concurrency = 8
+        self.logger.info('Reconciling votes with up to %s concurrent requests.', reconcile_concurrency)
+        self.reconciler = VoteReconciler(self, concurrency=int(reconcile_concurrency))
+
+        self.logger.debug('Loading RECONCILE_ON_READY_DAYS.')
+        reconcile_days = os.getenv('RECONCILE_ON_READY_DAYS')
+        if not reconcile_days:
+            self.logger.warning('No RECONCILE_ON_READY_DAYS defined, falling back to default.')
+            reconcile_days = 14
+        self.logger.info('Reconciling votes of new suggestions of the last %s days on startup.', reconcile_days)
+        self.reconcile_days = int(reconcile_days)
+        self.background_started = False
+
+        self.logger.debug('Loading JOB_WORKERS.')
+        job_workers = os.getenv('JOB_WORKERS')
+        if not job_workers:
+            self.logger.warning('No JOB_WORKERS defined, falling back to default.')
+            job_workers = 2
+        self.logger.debug('Loading JOBS_PER_GUILD.')
+        jobs_per_guild = os.getenv('JOBS_PER_GUILD')
+        if not jobs_per_guild:
+            self.logger.warning('No JOBS_PER_GUILD defined, falling back to default.')
+            jobs_per_guild = 1
+        self.logger.debug('Loading JOB_PROCESSES.')
+        job_processes = os.getenv('JOB_PROCESSES')
+        if not job_processes:
+            self.logger.warning('No JOB_PROCESSES defined, falling back to default.')
+            job_processes = 2
+        self.logger.info(
+            'Running up to %s jobs, %s per guild, with %s processes.', job_workers, jobs_per_guild, job_processes
+        )
+        self.jobs = JobRunner(self, workers=int(job_workers), per_guild=int(jobs_per_guild), processes=int(job_processes))
+
+        self.logger.debug('Loading OUTBOUND_QUEUE_SIZE.')
+        outbound_queue_size = os.getenv('OUTBOUND_QUEUE_SIZE')
+        if not outbound_queue_size:
+            self.logger.warning('No OUTBOUND_QUEUE_SIZE defined, falling back to default.')
+            outbound_queue_size = 1000
+        self.logger.debug('Loading OUTBOUND_WORKERS.')
+        outbound_workers = os.getenv('OUTBOUND_WORKERS')
+        if not outbound_workers:
+            self.logger.warning('No OUTBOUND_WORKERS defined, falling back to default.')
+            outbound_workers = 2
+        self.logger.info('Queueing up to %s deletes and DMs for %s workers.', outbound_queue_size, outbound_workers)
+        self.outbound = OutboundQueue(self.logger, max_size=int(outbound_queue_size), workers=int(outbound_workers))
+
+        self.logger.debug('Loading DUPLICATE_THRESHOLD.')
+        duplicate_threshold = os.getenv('DUPLICATE_THRESHOLD')
+        if not duplicate_threshold:
+            self.logger.warning('No DUPLICATE_THRESHOLD defined, falling back to default.')
+            duplicate_threshold = 0.6
+        self.logger.info('Flagging suggestions at least %s similar to an existing one.', duplicate_threshold)
+        self.duplicate_threshold = float(duplicate_threshold)
+
+        self.logger.debug('Loading METRICS.')
+        if os.getenv('METRICS', '').lower() in ('1', 'true', 'yes'):
+            metrics.enable()
+            logging.getLogger('discord.http').addHandler(RateLimitHandler(metrics))
+            self.http.request = self.timed_request(self.http.request)
+        self.metrics_host = os.getenv('METRICS_HOST', '127.0.0.1')
+        self.metrics_port = os.getenv('METRICS_PORT')
+        self.metrics_file = os.getenv('METRICS_FILE')
+        self.metrics_interval = float(os.getenv('METRICS_INTERVAL', 60))
+        self.metrics_started = False
+        self.logger.info('Collecting metrics: %s', metrics.enabled)
 
         self.logger.debug('Finished SuggestionBot.__init__')
 
-    def get_decline_reason(self, match):
-        if not match:
-            return 'Incorrect message format.'
-        summary = match.group('summary')
-        if len(summary) > self.max_length:
-            return 'Summary is to long.'
+    def timed_request(self, request):
+        # Times every REST call of discord.py, by route and not by URL.
+        async def timed(route, **kwargs):
+            with metrics.timer('rest_seconds', method=route.method, route=route.path):
+                return await request(route, **kwargs)
+        return timed
+
+    async def start_metrics(self):
+        self.metrics_started = True
+        if self.metrics_port:
+            await serve_metrics(self.metrics_host, int(self.metrics_port), self.logger)
+        if self.metrics_file:
+            self.loop.create_task(dump_metrics(self.metrics_file, self.metrics_interval, self.logger))
+
+    async def invoke(self, ctx):
+        with metrics.timer('command_seconds', command=ctx.command.name if ctx.command else 'unknown'):
+            await super().invoke(ctx)
 
     async def decline_message(self, message, decline_reason):
-        await message.delete()
-        dm_channel = await message.author.create_dm()
-        await dm_channel.send(
-            self.message_template.format(
+        self.outbound.delete(message)
+        self.outbound.send_dm(
+            message.author,
+            self.deletion_template.render(
                 channel=message.channel,
-                max_length=self.max_length,
                 orig_message=message.content,
                 reason=decline_reason
             )
         )
-        self.logger.info(f'Message from {message.author} in {message.channel}: {message.content}')
+        self.logger.info('Declined message from %s in %s.', message.author, message.channel)
+        self.logger.debug('Declined message content: %s', message.content)
 
     async def on_raw_reaction_add(self, payload):
-        await self.handle_reaction_change(payload)
+        await self.handle_reaction_change(payload, 1)
 
     async def on_raw_reaction_remove(self, payload):
-        await self.handle_reaction_change(payload)
+        await self.handle_reaction_change(payload, -1)
 
     async def on_raw_reaction_clear(self, payload):
         await self.handle_reaction_change(payload)
 
-    async def handle_reaction_change(self, payload):
-        self.logger.info(f'Got reaction change for message {payload.message_id}')
-        try:
-            suggestion = Suggestion.get(Suggestion.discord_id == payload.message_id)
-            channel = await self.fetch_channel(payload.channel_id)
-            message = await channel.fetch_message(payload.message_id)
-            up_votes = get_votes(message.reactions, UPVOTE)
-            down_votes = get_votes(message.reactions, DOWNVOTE)
-            if suggestion.up_votes == up_votes and suggestion.down_votes == down_votes:
-                self.logger.info(f'No change in votes for message {payload.message_id}')
+    async def on_raw_reaction_clear_emoji(self, payload):
+        await self.handle_reaction_change(payload)
+
+    @metrics.timed('event_seconds', event='reaction')
+    async def handle_reaction_change(self, payload, delta=None):
+        # delta is +1/-1 for a single added/removed reaction. Without a delta
+        # (reactions cleared) the votes can only be recounted from discord.
+        if not self.is_watched_channel(payload.channel_id):
+            self.logger.throttled('ignore-reaction', logging.INFO, 'Ignoring reaction, as channel %s is not a channel to watch.', payload.channel_id)
+            return
+        self.logger.info('Got reaction change for message %s', payload.message_id)
+        if delta is not None:
+            up_delta, down_delta = get_vote_deltas(payload.emoji, delta)
+            if not up_delta and not down_delta:
+                self.logger.throttled('not-a-vote', logging.INFO, 'Reaction %s on message %s is not a vote.', payload.emoji, payload.message_id)
+                return
+
+        if not await self.is_known_suggestion(payload.message_id):
+            self.logger.throttled('unknown-message', logging.INFO, 'Message %s not in database.', payload.message_id)
+            return
+
+        self.reaction_events += 1
+        if delta is None or (self.reconcile_rate and self.reaction_events % self.reconcile_rate == 0):
+            # A sampled reaction still counts if the message could not be read.
+            if await self.refetch_votes(payload.message_id, payload.channel_id) or delta is None:
                 return
-            suggestion.set_votes(up_votes, down_votes)
-            self.logger.info(f'Updated votes for message {payload.message_id}: {up_votes}x{UPVOTE} and {down_votes}x{DOWNVOTE}')
-        except Suggestion.DoesNotExist:
-            self.logger.info(f'Message {payload.message_id} not in database.')
 
+        self.votes.add(payload.message_id, payload.channel_id, up_delta, down_delta)
+        self.logger.info('Queued vote change for message %s: %+dx%s and %+dx%s', payload.message_id, up_delta, UPVOTE, down_delta, DOWNVOTE)
+
+    def is_watched_channel(self, channel_id):
+        return channel_id in self.registry.watched
+
+    async def is_known_suggestion(self, discord_id):
+        if self.known.loaded:
+            known = discord_id in self.known
+            metrics.inc('cache_requests_total', cache='known_suggestions', result='hit' if known else 'miss')
+            return known
+        return await self.repository.suggestion_exists(discord_id)
+
+    async def load_known_suggestions(self):
+        self.known.load(await self.repository.suggestion_ids())
+        stats = self.known.stats()
+        self.logger.info("Loaded %s known suggestions, using %s bytes.", stats['suggestions'], stats['bytes'])
+
+    async def on_raw_message_delete(self, payload):
+        self.known.discard(payload.message_id)
+
+    async def on_raw_bulk_message_delete(self, payload):
+        for message_id in payload.message_ids:
+            self.known.discard(message_id)
+
+    def schedule_refetch(self, discord_id, channel_id):
+        self.loop.create_task(self.refetch_votes(discord_id, channel_id))
+
+    async def refetch_votes(self, discord_id, channel_id):
+        # Returns False if the message could not be read.
+        try:
+            channel = self.get_channel(channel_id) or await self.fetch_channel(channel_id)
+            message = await channel.fetch_message(discord_id)
+        except NotFound:
+            self.logger.info('Message %s no longer exists, not refetching its votes.', discord_id)
+            self.known.discard(discord_id)
+            return False
+        except Forbidden:
+            self.logger.warning('Not allowed to refetch the votes of message %s in channel %s.', discord_id, channel_id)
+            return False
+        up_votes = get_votes(message.reactions, UPVOTE)
+        down_votes = get_votes(message.reactions, DOWNVOTE)
+        self.votes.set(discord_id, channel_id, up_votes, down_votes)
+        self.logger.info('Refetched votes for message %s: %sx%s and %sx%s', discord_id, up_votes, UPVOTE, down_votes, DOWNVOTE)
+        return True
+
+    async def close(self):
+        self.logger.info('Writing pending votes before shutdown.')
+        await self.jobs.stop()
+        self.history.stop()
+        await self.votes.stop()
+        await self.outbound.stop()
+        await super().close()
+        self.repository.close()
 
     def add_command(self, command):
         if command.name != 'help':
-            self.logger.info(f'Loading command: {command.name}')
+            self.logger.info('Loading command: %s', command.name)
         super().add_command(command)
 
-    def accept_message(self, message, match):
-        if not Suggestion.filter(discord_id=message.id).count():
-            summary = match.group('summary')
-            Suggestion.create(
-                discord_id=message.id,
-                channel_id=message.channel.id,
-                guild_id=message.guild.id,
-                summary=summary
-            )
-            self.logger.info(f'Saved message with ID {message.id} in database.')
+    async def accept_message(self, message, summary):
+        suggestion = await self.repository.create_suggestion(
+            discord_id=message.id,
+            channel_id=message.channel.id,
+            guild_id=message.guild.id,
+            summary=summary
+        )
+        if suggestion:
+            self.known.add(message.id)
+            self.leaderboard.invalidate([message.channel.id])
+            self.logger.info('Saved message with ID %s in database.', message.id)
+            if self.duplicate_threshold:
+                self.loop.create_task(self.flag_duplicates(message.guild, suggestion))
             return
-        self.logger.info(f'Message with ID {message.id} already in database.')
+        self.logger.info('Message with ID %s already in database.', message.id)
+
+    async def flag_duplicates(self, guild, suggestion):
+        try:
+            duplicates = await self.repository.duplicates(suggestion, self.duplicate_threshold)
+        except Exception as e:
+            self.logger.exception('Could not check suggestion %s for duplicates: %s', suggestion.id, e)
+            return
+        if not duplicates:
+            return
+        self.logger.info('Suggestion %s may be a duplicate of %s.', suggestion.id, [duplicate.id for _, duplicate in duplicates])
+        metrics.inc('duplicates_flagged_total')
+        embed = Embed(
+            title=f"Possible duplicate: [{suggestion.id}] {suggestion.summary}"[:MAX_EMBED_TITLE],
+            description=f"[Jump to suggestion](https://discordapp.com/channels/{suggestion.guild_id}/{suggestion.channel_id}/{suggestion.discord_id})",
+            color=0xF1C40F
+        )
+        for duplicate_similarity, duplicate in duplicates[:MAX_FLAGGED_DUPLICATES]:
+            name, value = render_field(duplicate)
+            embed.add_field(name=f"{duplicate_similarity:.0%} similar: {name}"[:MAX_EMBED_TITLE], value=value, inline=False)
+        for channel in self.registry.summary_channels(guild):
+            await channel.send(embed=embed)
 
     async def on_ready(self):
-        self.logger.info(f'Logged on as {self.user}!')
+        self.logger.info('Logged on as %s!', self.user)
+        if not self.sharded:
+            await self.prepare_guilds(self.guilds)
+        await self.start_background()
+
+    async def on_shard_ready(self, shard_id):
+        # Only dispatched by the sharded bot. Every shard prepares its own
+        # guilds as soon as it is ready, instead of waiting for all shards.
+        guilds = [guild for guild in self.guilds if guild.shard_id == shard_id]
+        self.logger.info('Shard %s is ready with %s guilds.', shard_id, len(guilds))
+        await self.start_background()
+        await self.prepare_guilds(guilds)
+
+    async def prepare_guilds(self, guilds):
+        for guild in guilds:
+            self.registry.load_guild(guild)
+        self.logger.info('Watching %s channels in %s guilds.', len(self.registry.watched), len(self.guilds))
+        if self.reconcile_days:
+            await self.reconcile_on_ready(guilds)
+        self.jobs.wake()
 
+    async def start_background(self):
+        if self.background_started:
+            return
+        self.background_started = True
+        if not self.known.loaded:
+            await self.load_known_suggestions()
+        if not self.votes.running:
+            self.votes.start(self.loop)
+        if not self.history.running:
+            self.history.start(self.loop)
+        if not self.outbound.running:
+            self.outbound.start(self.loop)
+        if not self.jobs.running:
+            await self.jobs.start(self.loop)
+        self.loop.create_task(self.rescore_on_algorithm_change())
+        if metrics.enabled and not self.metrics_started:
+            await self.start_metrics()
+
+    async def rescore_on_algorithm_change(self):
+        # The stored scores are only comparable if they were all computed by
+        # the same algorithm. The name is stored once all are rescored, so an
+        # interrupted rescore starts over on the next start.
+        try:
+            previous = await self.repository.setting(RANKING_SETTING)
+            if previous == self.ranking:
+                return
+            self.logger.info('Ranking changed from %s to %s, recomputing all scores.', previous, self.ranking)
+            updated = await rescore_suggestions(self.repository)
+            await self.repository.set_setting(RANKING_SETTING, self.ranking)
+        except Exception as e:
+            self.logger.exception('Could not recompute the scores: %s', e)
+            return
+        self.leaderboard.clear()
+        self.logger.info('Recomputed the %s score of %s suggestions.', self.ranking, updated)
+
+    async def reconcile_on_ready(self, guilds):
+        # Catch up on the votes missed while the bot was offline.
+        for guild in guilds:
+            await self.jobs.submit(
+                guild.id, 'update_votes', {'states': [STATE_NEW], 'days': self.reconcile_days}, unique=True
+            )
+
+    async def on_guild_join(self, guild):
+        self.registry.load_guild(guild)
+
+    async def on_guild_remove(self, guild):
+        self.registry.remove_guild(guild)
+        await self.jobs.cancel_guild(guild.id)
+
+    async def on_guild_channel_create(self, channel):
+        self.registry.add(channel)
+
+    async def on_guild_channel_update(self, before, after):
+        self.registry.update(before, after)
+
+    async def on_guild_channel_delete(self, channel):
+        self.registry.remove(channel)
+
+    @metrics.timed('event_seconds', event='message')
     async def on_message(self, message):
         if self.user == message.author:
             # Do not react to messages of the bot
             return
-        if message.channel.name == self.SUMMARY_CHANNEL:
+        if message.channel.id in self.registry.summary:
             await super().on_message(message)
             return
 
-        self.logger.info(f'Got message from {message.author} in {message.channel}')
-        if message.channel.name not in self.channels:
-            self.logger.info('Ignoring message, as its not in a channel to watch.')
+        if message.channel.id not in self.registry.watched:
+            self.logger.throttled('ignore-message', logging.INFO, 'Ignoring message, as its not in a channel to watch.')
             return
+        self.logger.info('Got message from %s in %s', message.author, message.channel)
 
-        match = self.check.match(message.content)
-        decline_reason = self.get_decline_reason(match)
+        summary, decline_reason = self.parser.parse(message.content)
         if not decline_reason or message.type == 18:
-            self.logger.info(f'Message from {message.author} accepted.')
-            self.accept_message(message, match)
+            self.logger.info('Message from %s accepted.', message.author)
+            if summary is None:
+                summary = self.parser.extract(message.content)
+            await self.accept_message(message, summary)
             return
 
         await self.decline_message(message, decline_reason)
+
+
+class SuggestionBot(SuggestionBotMixin, Bot):
+    pass
+
+
+class ShardedSuggestionBot(SuggestionBotMixin, AutoShardedBot):
+
+    sharded = True
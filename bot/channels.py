@@ -0,0 +1,56 @@
+from discord import TextChannel
+
+
+# Resolves the configured channel names to channel IDs once per guild, so
+# events only need set lookups. Kept current by the guild channel events.
+class ChannelRegistry:
+
+    def __init__(self, watch_names, summary_name):
+        self.watch_names = set(watch_names)
+        self.summary_name = summary_name
+        self.watched = set()
+        self.summary = set()
+        self._guild_watched = {}
+        self._guild_summary = {}
+
+    def load_guild(self, guild):
+        self.remove_guild(guild)
+        for channel in guild.text_channels:
+            self.add(channel)
+
+    def remove_guild(self, guild):
+        self.watched.difference_update(self._guild_watched.pop(guild.id, {}))
+        self.summary.difference_update(self._guild_summary.pop(guild.id, set()))
+
+    def add(self, channel):
+        if not isinstance(channel, TextChannel):
+            return
+        if channel.name in self.watch_names:
+            self.watched.add(channel.id)
+            self._guild_watched.setdefault(channel.guild.id, {})[channel.id] = channel.name
+        if channel.name == self.summary_name:
+            self.summary.add(channel.id)
+            self._guild_summary.setdefault(channel.guild.id, set()).add(channel.id)
+
+    def remove(self, channel):
+        self.watched.discard(channel.id)
+        self.summary.discard(channel.id)
+        self._guild_watched.get(channel.guild.id, {}).pop(channel.id, None)
+        self._guild_summary.get(channel.guild.id, set()).discard(channel.id)
+
+    def update(self, before, after):
+        self.remove(before)
+        self.add(after)
+
+    def watched_channels(self, guild):
+        channels = (guild.get_channel(channel_id) for channel_id in self._guild_watched.get(guild.id, {}))
+        return [channel for channel in channels if channel]
+
+    def summary_channels(self, guild):
+        channels = (guild.get_channel(channel_id) for channel_id in self._guild_summary.get(guild.id, set()))
+        return [channel for channel in channels if channel]
+
+    def watched_channel(self, guild, name):
+        for channel_id, channel_name in self._guild_watched.get(guild.id, {}).items():
+            if channel_name == name:
+                return guild.get_channel(channel_id)
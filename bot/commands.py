@@ -1,15 +1,17 @@
-import tempfile
-from csv import writer as CsvWriter
-from io import StringIO
-
+import time
 
 from discord import Embed
 from discord.ext import commands
-from discord import File
 
-from database.models import Suggestion, STATE_NEW, STATE_ACCEPTED, STATE_DECLINED
+from database.models import STATE_NEW, STATE_ACCEPTED, STATE_DECLINED, JOB_RUNNING, JOB_STATE_NAMES
+from database.models import ROLLUP_HOUR, ROLLUP_DAY, ROLLUP_SECONDS
+from metrics import metrics
 
-from .utils import UPVOTE, DOWNVOTE, get_votes
+from .utils import UPVOTE, DOWNVOTE
+from .export import ENCODERS
+from .jobs import MAX_QUEUED_PER_GUILD
+from .selection import parse_selection, SELECTION_HELP
+from .leaderboard import render_field
 
 POSSIBLE_STATES = {
     'new': STATE_NEW,
@@ -17,28 +19,45 @@ POSSIBLE_STATES = {
     'declined': STATE_DECLINED
 }
 
-STATE_NAMES = {
-    STATE_NEW: 'new',
-    STATE_ACCEPTED: 'accepted',
-    STATE_DECLINED: 'declined'
+TRANSITIONS = {
+    'accept': STATE_ACCEPTED,
+    'decline': STATE_DECLINED,
+    'renew': STATE_NEW
 }
 
+# Discord allows up to 25 fields per embed.
+MAX_EMBED_FIELDS = 25
+
+# Discord's limit for the title, description and fields of an embed together.
+MAX_EMBED_LENGTH = 6000
+
+# Discord's maximum message length.
+MAX_MESSAGE_LENGTH = 2000
+
+# Above this many updated suggestions only their number is reported.
+MAX_LISTED_IDS = 50
+
+# Suggestions shown by the search command.
+MAX_SEARCH_RESULTS = 10
+
+# Jobs shown by the jobs command.
+MAX_LISTED_JOBS = 10
+
+# Suggestions shown by the trending command.
+MAX_TRENDING = 10
 
-def sort_weighted_suggestions(msg):
-    return msg.votes['total'], msg.votes['up']
+# Longer trending windows are read from the daily rollups.
+TRENDING_HOURLY_WINDOW = 48
+
+# The daily rollups are kept for a year.
+MAX_TRENDING_HOURS = 365 * 24
 
 
 async def handle_channel(ctx, channel, state, page):
     selected_state = await get_selected_state(ctx, state)
     if state and selected_state is None:
         return
-    suggestions = Suggestion.select().where(
-        Suggestion.channel_id == channel.id,
-      Suggestion.state == selected_state
-    ).order_by(
-        Suggestion.up_votes.desc()
-    )
-    count = suggestions.count()
+    count, fields = await ctx.bot.leaderboard.page(channel, selected_state, page)
     if not count:
         await ctx.message.channel.send(f"I was not able to find any saved suggestions for '{channel.name}.' with the state '{state}'.")
         return
@@ -47,113 +66,121 @@ async def handle_channel(ctx, channel, state, page):
     endEntry = page * 5
     embed = Embed(
         title=f"Showing suggestions for #{channel.name}",
-        description=f"Here you the '{state}' suggestions {startEntry}-{endEntry} of {count}, sorted by up votes. Taken from the #{channel} channel.",
+        description=f"Here you the '{state}' suggestions {startEntry}-{endEntry} of {count}, sorted by {ctx.bot.ranking}. Taken from the #{channel} channel.",
         color=0x03C6AB
     )
-    for suggestion in suggestions.paginate(page, 5):
-        embed.add_field(
-            name=f"[{suggestion.id}] {suggestion.summary} | **{suggestion.up_votes}x{UPVOTE}** | **{suggestion.down_votes}x{DOWNVOTE}**",
-            value=f"[Jump to suggestion](https://discordapp.com/channels/{suggestion.guild_id}/{suggestion.channel_id}/{suggestion.discord_id})",
-            inline=False
-        )
+    for name, value in fields:
+        embed.add_field(name=name, value=value, inline=False)
     await ctx.message.channel.send(embed=embed)
 
+
+async def handle_channels(ctx, channels, state, page):
+    # Same as handle_channel, but with all channels in as few embeds as possible.
+    selected_state = await get_selected_state(ctx, state)
+    if state and selected_state is None:
+        return
+    startEntry = ((page - 1) * 5) + 1
+    endEntry = page * 5
+    sections = []
+    for channel in channels:
+        count, fields = await ctx.bot.leaderboard.page(channel, selected_state, page)
+        if count:
+            sections.append([(f"#{channel.name}", f"Suggestions {startEntry}-{endEntry} of {count}")] + fields)
+    if not sections:
+        await ctx.message.channel.send(f"I was not able to find any saved suggestions with the state '{state}'.")
+        return
+
+    embeds = []
+
+    def fits(fields):
+        return (
+            len(embeds[-1].fields) + len(fields) <= MAX_EMBED_FIELDS
+            and len(embeds[-1]) + sum(len(name) + len(value) for name, value in fields) <= MAX_EMBED_LENGTH
+        )
+
+    def new_embed():
+        embeds.append(Embed(
+            title="Showing suggestions",
+            description=f"Here you the '{state}' suggestions of all watched channels, sorted by {ctx.bot.ranking}.",
+            color=0x03C6AB
+        ))
+
+    for section in sections:
+        # A channel is only split over two embeds if it does not fit into one.
+        if not embeds or not fits(section):
+            new_embed()
+        for name, value in section:
+            if embeds[-1].fields and not fits([(name, value)]):
+                new_embed()
+            embeds[-1].add_field(name=name, value=value, inline=False)
+    for embed in embeds:
+        await ctx.message.channel.send(embed=embed)
+
+
 async def get_selected_state(ctx, state):
     selected_state = POSSIBLE_STATES.get(state)
     if selected_state is None:
-        ctx.bot.logger.info(f"State '{state}' is not a valid state.")
+        ctx.bot.logger.info("State '%s' is not a valid state.", state)
         await ctx.message.channel.send(f"I'm sorry, '{state}' is not a valid state. Please choose one of: new, accepted, declined")
         return
     return selected_state
 
 
 async def change_state(ctx, new_state, *ids):
-    suggestions = Suggestion.select().where(Suggestion.id.in_(ids))
-    updated = []
-    ctx.bot.logger.info(f"Found {suggestions.count()} suggestions, for IDs {ids}.")
-    for suggestion in suggestions:
-        getattr(suggestion, new_state)()
-        ctx.bot.logger.info(f"Updated {suggestion.id} and set state to {new_state}.")
-        updated.append(suggestion.id)
-    message = f"No suggestions found for the IDs: {ids}."
-    if updated:
+    if not ids:
+        await ctx.message.channel.send(f"Please select the suggestions. {SELECTION_HELP}")
+        return
+    try:
+        condition = parse_selection(ctx.guild.id, ids)
+    except ValueError as e:
+        ctx.bot.logger.info("Could not parse the selection %s: %s", ids, e)
+        await ctx.message.channel.send(f"I'm sorry, I did not understand '{e}'. {SELECTION_HELP}")
+        return
+    changed = await ctx.bot.repository.change_state(condition, TRANSITIONS[new_state])
+    updated = sorted(suggestion_id for suggestion_id, _ in changed)
+    ctx.bot.leaderboard.invalidate({channel_id for _, channel_id in changed})
+    ctx.bot.logger.info("Set state of %s suggestions to %s for %s: %s.", len(updated), new_state, ids, updated)
+    message = f"No suggestions found for: {ids}."
+    if len(updated) > MAX_LISTED_IDS:
+        message = f"Added {len(updated)} suggestions to the {new_state} list."
+    elif updated:
         message = f"Added {updated} to the {new_state} list."
     await ctx.message.channel.send(message)
-async def index_channel(ctx, channel):
-    ctx.bot.logger.info(f"Indexing channel '{channel}'.")
-    async for message in channel.history(limit=None):
-        if message.author == ctx.bot.user:
-            continue
-
-        match = ctx.bot.check.match(message.content)
-        decline_reason = ctx.bot.get_decline_reason(match)
-        if not decline_reason:
-            ctx.bot.logger.info(f'Message from {message.author} in correct format.')
-            suggestions = Suggestion.filter(Suggestion.discord_id == message.id)
-            if suggestions.count():
-                ctx.bot.logger.info(f'Found suggestion for message with ID {message.id}.')
-                continue
-            ctx.bot.logger.info(f'Creating suggestion for message with ID {message.id}.')
-            summary = match.group('summary')
-            up_votes = get_votes(message.reactions, UPVOTE)
-            down_votes = get_votes(message.reactions, DOWNVOTE)
-            suggestion = Suggestion.create(
-                guild_id=ctx.guild.id,
-                channel_id=channel.id,
-                discord_id=message.id,
-                up_votes=up_votes,
-                down_votes=down_votes,
-                summary=summary,
-                state=STATE_NEW
-            )
-            ctx.bot.logger.info(f"Created suggestion {suggestion.id} for message {message.id} in channel {channel.name}.")
-
-
-async def export_channel(ctx, channel, state):
-    selected_state = None
-    if state:
-        selected_state = await get_selected_state(ctx, state)
-        if selected_state is None:
-            return
-    query = { "channel_id": channel.id }
-    if selected_state:
-        query['state'] = selected_state
-    suggestions_to_export = Suggestion.filter(**query)
-    if not suggestions_to_export.count():
-        ctx.bot.logger.info(f"No suggestions found for channel {channel.name} with state {state} (None = all states)")
-        await ctx.message.channel.send(f"I was not able to find any saved suggestions for '{channel.name}' with the state '{state}'.")
+
+
+async def queue_job(ctx, kind, params, message):
+    job = await ctx.bot.jobs.submit(ctx.guild.id, kind, params, channel_id=ctx.message.channel.id, author_id=ctx.author.id)
+    if job is None:
+        await ctx.message.channel.send(
+            f"I'm sorry, this server already has {MAX_QUEUED_PER_GUILD} queued jobs. Please try again once some of them are done."
+        )
         return
-    ctx.bot.logger.info(f"Exporting {suggestions_to_export.count()} suggestions for channel {channel.name} with state {state} (None = all states)")
-    with tempfile.NamedTemporaryFile(mode="w+", suffix='.csv') as csvFile:
-        fieldnames = ['id', 'summary', 'state', 'up_votes', 'down_votes', 'link']
-        csv_writer = CsvWriter(csvFile)
-        csv_writer.writerow(fieldnames)
-        for suggestion in suggestions_to_export:
-            csv_writer.writerow([
-                suggestion.id,
-                suggestion.summary,
-                STATE_NAMES[suggestion.state],
-                suggestion.up_votes,
-                suggestion.down_votes,
-                f"https://discordapp.com/channels/{suggestion.guild_id}/{suggestion.channel_id}/{suggestion.discord_id}"
-            ])
-        csvFile.seek(0)
-        if state:
-            filename = f"{channel.name}-{state}.csv"
-        else:
-            filename = f"{channel.name}.csv"
-        ctx.bot.logger.info(f"Sending exported suggestions for channel {channel.name} with state {state} (None = all states) to {ctx.message.author}.")
-        await ctx.message.channel.send(file=File(StringIO(csvFile.read()), filename=filename))
+    waiting = ''
+    if ctx.bot.jobs.running_in(ctx.guild.id) >= ctx.bot.jobs.per_guild:
+        waiting = ' It starts as soon as the running jobs of this server are done.'
+    await ctx.message.channel.send(f"{message} This is job {job.id}, check on it with '{ctx.prefix}job {job.id}'.{waiting}")
+
+
+def render_job(ctx, job):
+    progress = ctx.bot.jobs.progress(job.id) or job.progress
+    line = f"{job.id}: {job.kind}, {JOB_STATE_NAMES[job.state]}, queued <t:{int(job.created_at)}:R>"
+    if job.state == JOB_RUNNING and progress:
+        line += f", {progress}"
+    elif job.result:
+        line += f", {job.result}"
+    return line
 
 
 @commands.command(
     brief="Show suggestions",
     help="Shows a list of suggestions of the specified state. State can be new, accepted or declined. If none is provided, new will be assumed."
 )
-async def show(ctx, state="new", page=1):
-    ctx.bot.logger.info(f"Got 'show' command from {ctx.author} with state '{state}'.")
-    channels = [channel for channel in ctx.guild.text_channels if channel.name in ctx.bot.channels]
-
+async def show(ctx, state="new", page: int = 1):
+    ctx.bot.logger.info("Got 'show' command from %s with state '%s'.", ctx.author, state)
+    channels = ctx.bot.registry.watched_channels(ctx.guild)
+    if ctx.bot.show_single_embed:
+        await handle_channels(ctx, channels, state, page)
+        return
     for channel in channels:
         await handle_channel(ctx, channel, state, page)
         
@@ -162,16 +189,13 @@ async def show(ctx, state="new", page=1):
     brief="Show suggestions for a specified channel",
     help="Shows a list of suggestions of the specified state and channel. State can be new, accepted or declined. If none is provided, new will be assumed."
 )
-async def show_channel(ctx, channel=None, state="new", page=1):
+async def show_channel(ctx, channel=None, state="new", page: int = 1):
     if not channel:
         await ctx.message.channel.send("Please provide a channel name.")
         return
-    ctx.bot.logger.info(f"Got 'show-channel' command from {ctx.author} with state '{state}' for channel '{channel}'.")
+    ctx.bot.logger.info("Got 'show-channel' command from %s with state '%s' for channel '%s'.", ctx.author, state, channel)
 
-    channel_to_handle = None
-    for text_channel in ctx.guild.text_channels:
-        if text_channel.name == channel:
-            channel_to_handle = text_channel
+    channel_to_handle = ctx.bot.registry.watched_channel(ctx.guild, channel)
     if channel_to_handle:
         await handle_channel(ctx, channel_to_handle, state, page)
     else:
@@ -180,89 +204,240 @@ async def show_channel(ctx, channel=None, state="new", page=1):
 
 @commands.command(
     brief="Accept suggestions",
-    help="Accept suggestions. Suggestions are selected via the provided IDs."
+    help=f"Accept suggestions. {SELECTION_HELP}"
 )
 async def accept(ctx, *ids):
-    ctx.bot.logger.info(f"Got 'accept' command from {ctx.author} for IDs '{ids}'.")
+    ctx.bot.logger.info("Got 'accept' command from %s for IDs '%s'.", ctx.author, ids)
     await change_state(ctx, 'accept', *ids)
 
 
 @commands.command(
     brief="Decline suggestions",
-    help="Decline suggestions. Suggestions are selected via the provided IDs."
+    help=f"Decline suggestions. {SELECTION_HELP} E.g. 'decline state:new up<3 older:90'."
 )
 async def decline(ctx, *ids):
-    ctx.bot.logger.info(f"Got 'decline' command from {ctx.author} for IDs '{ids}'.")
+    ctx.bot.logger.info("Got 'decline' command from %s for IDs '%s'.", ctx.author, ids)
     await change_state(ctx, 'decline', *ids)
 
 
 @commands.command(
     brief="Set state of suggestions back to new",
-    help="Set the state of suggestions back to new. Suggestions are selected via the provided IDs."
+    help=f"Set the state of suggestions back to new. {SELECTION_HELP}"
 )
 async def renew(ctx, *ids):
-    ctx.bot.logger.info(f"Got 'renew' command from {ctx.author} for IDs '{ids}'.")
+    ctx.bot.logger.info("Got 'renew' command from %s for IDs '%s'.", ctx.author, ids)
     await change_state(ctx, 'renew', *ids)
 
 
 @commands.command(
     brief="Update the vote counts of existing suggestions",
-    help="If the bot was offline for any reason, you can run update_votes to correct the votes int the database."
+    help="If the bot was offline for any reason, you can run update_votes to correct the votes int the database. Optionally only suggestions of a state (new, accepted or declined) and of the last n days get updated."
 )
-async def update_votes(ctx):
-    ctx.bot.logger.info(f"Got the 'update_votes' command from {ctx.author}.")
-    await ctx.message.channel.send(f"Ok Human. I'll update all the votes, of all suggestions... *sigh*")
-    for suggestion in Suggestion.filter():
-        channel = ctx.guild.get_channel(int(suggestion.channel_id))
-        if channel:
-            message = await channel.fetch_message(suggestion.discord_id)
-            up_votes = get_votes(message.reactions, UPVOTE)
-            down_votes = get_votes(message.reactions, DOWNVOTE)
-            if suggestion.up_votes == up_votes and suggestion.down_votes == down_votes:
-                ctx.bot.logger.info(f'No change in votes for message {suggestion.discord_id}')
-                continue
-            suggestion.set_votes(up_votes, down_votes)
-            ctx.bot.logger.info(f'Updated votes for message {suggestion.discord_id}: {up_votes}x{UPVOTE} and {down_votes}x{DOWNVOTE}')
-    await ctx.message.channel.send(f"There you go. All votes should be up to date.")
+async def update_votes(ctx, state=None, days: int = 0):
+    ctx.bot.logger.info("Got the 'update_votes' command from %s with state '%s' and days '%s'.", ctx.author, state, days)
+    states = None
+    if state:
+        selected_state = await get_selected_state(ctx, state)
+        if selected_state is None:
+            return
+        states = [selected_state]
+    await queue_job(ctx, 'update_votes', {'states': states, 'days': days}, "Ok Human. I'll update all the votes, of all suggestions... *sigh*")
+
 
-        
 @commands.command(
     brief="Index all messages in all WATCH_CHANNELS",
     help="Index all messages in all WATCH_CHANNELS. This might take some time. All messages not already saved will be added to the database."
 )
 async def index_channels(ctx):
-    ctx.bot.logger.info(f"Got 'index' command from {ctx.author}.")
-    await ctx.message.channel.send(f"Human wants me to work, eh? This will take some time, please be patient...")
-    old_count = Suggestion.select().count()
-    for channel in ctx.guild.channels:
-        if channel.name in ctx.bot.channels: 
-            if channel:
-                await index_channel(ctx, channel)
-    await ctx.message.channel.send(f"Done! I had {old_count} suggestions in my DB and now I have {Suggestion.filter().count()}")
+    ctx.bot.logger.info("Got 'index' command from %s.", ctx.author)
+    await queue_job(ctx, 'index', {}, "Human wants me to work, eh? This will take some time, please be patient...")
 
 
 @commands.command(
-    brief="Export all suggestions to a CSV file",
-    help="Export all suggestions to a CSV file. The file will be send to the user."
+    brief="Export all suggestions to a gzip compressed CSV or JSONL file",
+    help="Export all suggestions to a gzip compressed file. The file will be send to the user. Optionally only a channel ('all' for a single file with all channels) and a state (new, accepted, declined or all) gets exported. The format can be csv or jsonl. Files too large to upload get split into parts."
 )
-async def export(ctx, channel=None, state=None):
-    ctx.bot.logger.info(f"Got 'export' command from {ctx.author}.")
-    channels_to_handle = []
-    for chn in ctx.guild.text_channels:
-        if chn.name in ctx.bot.channels:
-            channels_to_handle.append(chn)
-
-    if channel:
-        channels_to_handle = [chn for chn in channels_to_handle if chn.name == channel and chn.name in ctx.bot.channels]
-    else:
-        channels_to_handle = [chn for chn in ctx.guild.text_channels if chn.name in ctx.bot.channels]
+async def export(ctx, channel=None, state=None, fmt="csv"):
+    ctx.bot.logger.info("Got 'export' command from %s.", ctx.author)
+    if state == "all":
+        state = None
+    selected_state = None
+    if state:
+        selected_state = await get_selected_state(ctx, state)
+        if selected_state is None:
+            return
+    if fmt not in ENCODERS:
+        await ctx.message.channel.send(f"I'm sorry, '{fmt}' is not a valid format. Please choose one of: {', '.join(ENCODERS)}")
+        return
 
-    if channels_to_handle:
-        ctx.bot.logger.info(f"Preparing to export the following channels: {channels_to_handle}.")
-        for chn in channels_to_handle:
-            await export_channel(ctx, chn, state)
+    if channel and channel != "all":
+        channels_to_handle = [chn for chn in [ctx.bot.registry.watched_channel(ctx.guild, channel)] if chn]
     else:
+        channels_to_handle = ctx.bot.registry.watched_channels(ctx.guild)
+    if not channels_to_handle:
         await ctx.message.channel.send(f"I'm not watching the '{channel}'. Channels watched are '{ctx.bot.channels}'.")
+        return
+
+    if channel == "all":
+        ctx.bot.logger.info("Preparing to export the following channels into one file: %s.", channels_to_handle)
+        files = [["suggestions", {chn.id: chn.name for chn in channels_to_handle}]]
+    else:
+        ctx.bot.logger.info("Preparing to export the following channels: %s.", channels_to_handle)
+        files = [[chn.name, {chn.id: chn.name}] for chn in channels_to_handle]
+    params = {'files': files, 'state': selected_state, 'state_name': state, 'fmt': fmt}
+    await queue_job(ctx, 'export', params, "I'll export the suggestions.")
+
+
+@commands.command(
+    brief="Show trending suggestions",
+    help="Shows the suggestions that gained the most net votes in the last n hours, 24 if none is provided. State can be new, accepted, declined or all. If none is provided, new will be assumed. The vote history is updated every few minutes."
+)
+async def trending(ctx, hours: int = 24, state="new"):
+    ctx.bot.logger.info("Got 'trending' command from %s for %s hours with state '%s'.", ctx.author, hours, state)
+    if not 1 <= hours <= MAX_TRENDING_HOURS:
+        await ctx.message.channel.send(f"I'm sorry, I can only show trends of the last 1 to {MAX_TRENDING_HOURS} hours.")
+        return
+    selected_state = None
+    if state != "all":
+        selected_state = await get_selected_state(ctx, state)
+        if selected_state is None:
+            return
+    resolution = ROLLUP_HOUR if hours <= TRENDING_HOURLY_WINDOW else ROLLUP_DAY
+    now = time.time()
+    since = int(now) - hours * 3600
+    since -= since % ROLLUP_SECONDS[resolution]
+    # The window starts at the beginning of its first bucket.
+    covered_hours = (now - since) / 3600
+    results = await ctx.bot.repository.trending(ctx.guild.id, resolution, since, selected_state, MAX_TRENDING)
+    if not results:
+        await ctx.message.channel.send(f"No '{state}' suggestion gained votes in the last {hours} hours.")
+        return
+    embed = Embed(
+        title=f"Trending suggestions of the last {hours} hours",
+        description=f"The '{state}' suggestions with the most net votes gained.",
+        color=0x03C6AB
+    )
+    for suggestion, gained_up, gained_down in results:
+        name, value = render_field(suggestion)
+        velocity = (gained_up - gained_down) / covered_hours
+        embed.add_field(
+            name=name,
+            value=f"{gained_up:+d}x{UPVOTE} {gained_down:+d}x{DOWNVOTE}, {velocity:.2f} net votes per hour | {value}",
+            inline=False
+        )
+    await ctx.message.channel.send(embed=embed)
+
+
+@commands.command(
+    brief="Search suggestions",
+    help="Search the summaries of all suggestions of this server, best matches first. Every word has to match, the last one can be the start of a word. Start with 'state:new', 'state:accepted' or 'state:declined' to only search suggestions of that state."
+)
+async def search(ctx, *words):
+    ctx.bot.logger.info("Got 'search' command from %s for '%s'.", ctx.author, words)
+    state = None
+    if words and words[0].startswith('state:'):
+        state = await get_selected_state(ctx, words[0][len('state:'):])
+        if state is None:
+            return
+        words = words[1:]
+    text = ' '.join(words)
+    if not text:
+        await ctx.message.channel.send("Please tell me what to search for.")
+        return
+    results = await ctx.bot.repository.search(ctx.guild.id, text, state=state, limit=MAX_SEARCH_RESULTS)
+    if not results:
+        await ctx.message.channel.send(f"I was not able to find any suggestions matching '{text}'.")
+        return
+    embed = Embed(
+        title=f"Suggestions matching '{text}'",
+        description=f"The {len(results)} best matches.",
+        color=0x03C6AB
+    )
+    for suggestion in results:
+        name, value = render_field(suggestion)
+        embed.add_field(name=name, value=value, inline=False)
+    await ctx.message.channel.send(embed=embed)
+
+
+@commands.command(
+    brief="List the jobs of this server",
+    help="List the latest index, export and update_votes jobs of this server with their state."
+)
+async def jobs(ctx):
+    ctx.bot.logger.info("Got 'jobs' command from %s.", ctx.author)
+    recent = await ctx.bot.repository.recent_jobs(ctx.guild.id, MAX_LISTED_JOBS)
+    if not recent:
+        await ctx.message.channel.send("There are no jobs on this server.")
+        return
+    await ctx.message.channel.send("\n".join(render_job(ctx, job) for job in recent)[:MAX_MESSAGE_LENGTH])
+
+
+@commands.command(
+    brief="Show the progress of a job",
+    help="Show the state and progress of a job of this server."
+)
+async def job(ctx, job_id: int):
+    ctx.bot.logger.info("Got 'job' command from %s for job %s.", ctx.author, job_id)
+    found = await ctx.bot.repository.job(ctx.guild.id, job_id)
+    if found is None:
+        await ctx.message.channel.send(f"I'm sorry, there is no job {job_id} on this server.")
+        return
+    await ctx.message.channel.send(render_job(ctx, found)[:MAX_MESSAGE_LENGTH])
+
+
+@commands.command(
+    brief="Cancel a job",
+    help="Cancel a queued or running job of this server. Suggestions an index job already saved are kept, it continues from there when started again."
+)
+async def cancel(ctx, job_id: int):
+    ctx.bot.logger.info("Got 'cancel' command from %s for job %s.", ctx.author, job_id)
+    previous_state = await ctx.bot.jobs.cancel(ctx.guild.id, job_id)
+    if previous_state is None:
+        await ctx.message.channel.send(f"I'm sorry, there is no queued or running job {job_id} on this server.")
+        return
+    await ctx.message.channel.send(f"Cancelled the {JOB_STATE_NAMES[previous_state]} job {job_id}.")
+
+
+@commands.command(
+    brief="Recompute the ranking score of all suggestions",
+    help="Recompute the ranking score of all suggestions of this server with the current RANKING_ALGORITHM. The bot already does this on startup after the algorithm changed."
+)
+async def rescore(ctx):
+    ctx.bot.logger.info("Got 'rescore' command from %s.", ctx.author)
+    await queue_job(ctx, 'rescore', {}, f"Recomputing the {ctx.bot.ranking} score of all suggestions of this server.")
+
+
+@commands.command(
+    brief="Show performance statistics of the bot",
+    help="Show event rates, latencies, database wait times and cache hit rates. Needs METRICS to be enabled for everything but the database and cache sizes."
+)
+async def stats(ctx):
+    ctx.bot.logger.info("Got 'stats' command from %s.", ctx.author)
+    lines = metrics.summary() if metrics.enabled else ['Metrics are disabled, set METRICS=true to collect them.']
+    for pool, pool_stats in ctx.bot.repository.stats().items():
+        lines.append(
+            f"db {pool}: {pool_stats['calls']} calls, wait avg {pool_stats['wait_avg'] * 1000:.2f}ms, "
+            f"max {pool_stats['wait_max'] * 1000:.2f}ms, run avg {pool_stats['run_avg'] * 1000:.2f}ms"
+        )
+    known = ctx.bot.known.stats()
+    lines.append(f"known suggestions: {known['suggestions']}, {known['bytes'] / 1024:.0f} KiB")
+    lines.append(f"leaderboard cache: {ctx.bot.leaderboard.hits} hits, {ctx.bot.leaderboard.misses} misses")
+    job_stats = ctx.bot.jobs.stats()
+    lines.append(f"jobs: {job_stats['running']} running, at most {job_stats['workers']} and {job_stats['per_guild']} per server")
+    outbound = ctx.bot.outbound.stats()
+    lines.append(
+        f"outbound: {outbound['deletes']} deletes and {outbound['dms']} DMs queued, {outbound['sent']} sent, "
+        f"{outbound['retried']} retried, {outbound['deduplicated']} deduplicated, {outbound['dropped']} dropped, "
+        f"{outbound['failed']} failed"
+    )
+
+    message = ''
+    for line in lines:
+        if len(message) + len(line) + 8 > MAX_MESSAGE_LENGTH:
+            await ctx.message.channel.send(f"```\n{message}```")
+            message = ''
+        message += line + '\n'
+    await ctx.message.channel.send(f"```\n{message}```")
 
 
-COMMANDS = [show, show_channel, accept, decline, renew, index_channels, update_votes, export]
+COMMANDS = [show, show_channel, accept, decline, renew, index_channels, update_votes, export, jobs, job, cancel, trending, search, rescore, stats]
@@ -0,0 +1,127 @@
+import gzip
+import json
+import zlib
+from csv import writer as CsvWriter
+from io import BytesIO, StringIO
+
+from database.models import Suggestion, STATE_NAMES
+
+FIELDNAMES = ['id', 'summary', 'state', 'up_votes', 'down_votes', 'link']
+
+# Uncompressed bytes after which the gzip stream gets flushed. Bounds the data
+# zlib holds back, so the size of a part is known before it is too late.
+FLUSH_EVERY = 64 * 1024
+
+# Room for the gzip trailer and flush markers.
+GZIP_OVERHEAD = 1024
+
+
+def suggestion_link(suggestion):
+    return f"https://discordapp.com/channels/{suggestion.guild_id}/{suggestion.channel_id}/{suggestion.discord_id}"
+
+
+class CsvEncoder:
+    extension = 'csv'
+
+    def __init__(self, fieldnames):
+        self.fieldnames = fieldnames
+        self._line = StringIO()
+        self._writer = CsvWriter(self._line)
+
+    def header(self):
+        return self._encode(self.fieldnames)
+
+    def encode(self, row):
+        return self._encode([row[field] for field in self.fieldnames])
+
+    def _encode(self, values):
+        self._line.seek(0)
+        self._line.truncate()
+        self._writer.writerow(values)
+        return self._line.getvalue().encode('utf-8')
+
+
+class JsonLinesEncoder:
+    extension = 'jsonl'
+
+    def __init__(self, fieldnames):
+        self.fieldnames = fieldnames
+
+    def header(self):
+        return b''
+
+    def encode(self, row):
+        return (json.dumps({field: row[field] for field in self.fieldnames}, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+ENCODERS = {
+    'csv': CsvEncoder,
+    'jsonl': JsonLinesEncoder,
+}
+
+
+# Gzip compressed output, split into independent parts (each with the header)
+# of at most max_bytes.
+class GzipParts:
+
+    def __init__(self, max_bytes, header=b''):
+        self.max_bytes = max_bytes
+        self.header = header
+        self.parts = []
+        self._start()
+
+    def _start(self):
+        self._buffer = BytesIO()
+        self._gzip = gzip.GzipFile(fileobj=self._buffer, mode='wb')
+        self._unflushed = 0
+        self._rows = 0
+        self._write(self.header)
+
+    def _write(self, data):
+        self._gzip.write(data)
+        self._unflushed += len(data)
+        if self._unflushed >= FLUSH_EVERY:
+            self._gzip.flush(zlib.Z_SYNC_FLUSH)
+            self._unflushed = 0
+
+    def write_row(self, data):
+        # Assumes the worst case, that nothing unflushed compresses at all.
+        if self._rows and self._buffer.tell() + self._unflushed + len(data) + GZIP_OVERHEAD > self.max_bytes:
+            self._finish()
+            self._start()
+        self._write(data)
+        self._rows += 1
+
+    def _finish(self):
+        self._gzip.close()
+        self._buffer.seek(0)
+        self.parts.append(self._buffer)
+
+    def close(self):
+        self._finish()
+        return self.parts
+
+
+def export_suggestions(guild_id, channels, state, fmt, max_bytes):
+    # Runs in the job process pool, see workers.export_files. channels maps the channel IDs to export to
+    # their names, with more than one channel a 'channel' column is added.
+    # Returns the number of exported suggestions and the gzip parts.
+    fieldnames = FIELDNAMES if len(channels) == 1 else ['channel'] + FIELDNAMES
+    encoder = ENCODERS[fmt](fieldnames)
+    parts = GzipParts(max_bytes, encoder.header())
+    query = Suggestion.select().where(Suggestion.guild_id == guild_id, Suggestion.channel_id.in_(list(channels)))
+    if state is not None:
+        query = query.where(Suggestion.state == state)
+    count = 0
+    for suggestion in query.order_by(Suggestion.channel_id, Suggestion.id).iterator():
+        parts.write_row(encoder.encode({
+            'channel': channels[suggestion.channel_id],
+            'id': suggestion.id,
+            'summary': suggestion.summary,
+            'state': STATE_NAMES[suggestion.state],
+            'up_votes': suggestion.up_votes,
+            'down_votes': suggestion.down_votes,
+            'link': suggestion_link(suggestion),
+        }))
+        count += 1
+    return count, parts.close()
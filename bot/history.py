@@ -0,0 +1,47 @@
+import asyncio
+import time
+
+from database.models import ROLLUP_HOUR, ROLLUP_DAY
+
+# Seconds the rollups are kept.
+ROLLUP_RETENTION = {
+    ROLLUP_HOUR: 30 * 86400,
+    ROLLUP_DAY: 365 * 86400
+}
+
+
+# Every vote flush appends the vote changes to the event log. This compacts
+# the log into hourly and daily rollups every `interval` seconds and applies
+# the retention, so trending only ever reads the small rollups.
+class VoteHistory:
+
+    def __init__(self, logger, repository, interval, event_retention_days):
+        self.logger = logger
+        self.repository = repository
+        self.interval = interval
+        self.event_retention = event_retention_days * 86400
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self, loop):
+        self._task = loop.create_task(self._run())
+
+    def stop(self):
+        if self.running:
+            self._task.cancel()
+
+    async def compact(self):
+        compacted, deleted = await self.repository.compact_votes(int(time.time()), self.event_retention, ROLLUP_RETENTION)
+        self.logger.info('Compacted %s vote events, deleted %s old events and rollups.', compacted, deleted)
+        return compacted, deleted
+
+    async def _run(self):
+        while True:
+            try:
+                await self.compact()
+            except Exception as e:
+                self.logger.exception('Could not compact the vote history: %s', e)
+            await asyncio.sleep(self.interval)
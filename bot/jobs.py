@@ -0,0 +1,401 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from multiprocessing import get_context
+
+from discord import File, Object, HTTPException
+
+from database import db
+from database.models import JOB_DONE, JOB_FAILED
+from metrics import metrics
+
+from .utils import get_votes, UPVOTE, DOWNVOTE
+from .export import ENCODERS
+from .workers import init_worker, export_files, index_messages
+
+# Messages read from the history before they are parsed and written.
+INDEX_CHUNK_SIZE = 500
+
+# Seconds between updates of the progress message and the job's progress.
+PROGRESS_INTERVAL = 5
+
+# Finished jobs are deleted after a week.
+JOB_RETENTION = 7 * 24 * 3600
+
+# Queued jobs looked at per scheduling query, at most one per guild.
+SCHEDULE_BATCH = 100
+
+# Further jobs of a guild are refused while it has this many queued.
+MAX_QUEUED_PER_GUILD = 20
+
+# Length of the progress column.
+MAX_PROGRESS_LENGTH = 255
+
+# Suggestions rescored per write, so vote flushes get the writer in between.
+RESCORE_CHUNK_SIZE = 1000
+
+
+class JobContext:
+
+    def __init__(self, runner, job, guild):
+        self.runner = runner
+        self.bot = runner.bot
+        self.job = job
+        self.guild = guild
+        self.channel = guild.get_channel(job.channel_id) if job.channel_id else None
+        self.params = json.loads(job.params)
+        self.progress = job.progress
+        self._last_progress = 0
+
+    async def send(self, content=None, **kwargs):
+        # Jobs queued on startup have no channel to report to.
+        if self.channel is None:
+            return None
+        try:
+            return await self.channel.send(content, **kwargs)
+        except HTTPException as e:
+            self.bot.logger.warning('Could not report on job %s: %s', self.job.id, e)
+
+    async def set_progress(self, progress, force=False):
+        self.progress = progress
+        now = time.monotonic()
+        if force or now - self._last_progress >= PROGRESS_INTERVAL:
+            self._last_progress = now
+            await self.bot.repository.set_job_progress(self.job.id, progress[:MAX_PROGRESS_LENGTH])
+
+
+class IndexProgress:
+
+    def __init__(self, context, channels):
+        self.context = context
+        self.scanned = {channel.name: 0 for channel in channels}
+        self.created = {channel.name: 0 for channel in channels}
+        self.done = set()
+        self.message = None
+        self.last_update = 0
+
+    def render(self):
+        lines = []
+        for name in self.scanned:
+            status = 'done' if name in self.done else 'indexing'
+            lines.append(f"#{name}: {status}, scanned {self.scanned[name]} messages, {self.created[name]} new suggestions")
+        return "\n".join(lines)
+
+    async def update(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_update < PROGRESS_INTERVAL:
+            return
+        self.last_update = now
+        await self.context.set_progress(
+            f"scanned {sum(self.scanned.values())} messages, {sum(self.created.values())} new suggestions", force=True
+        )
+        if self.message is None:
+            self.message = await self.context.send(self.render())
+        else:
+            await self.message.edit(content=self.render())
+
+
+async def run_index(context):
+    repository = context.bot.repository
+    old_count = await repository.count(guild_id=context.guild.id)
+    channels = context.bot.registry.watched_channels(context.guild)
+    progress = IndexProgress(context, channels)
+    await asyncio.gather(*[index_channel(context, channel, progress) for channel in channels])
+    new_count = await repository.count(guild_id=context.guild.id)
+    return f"Done! I had {old_count} suggestions of this server in my DB and now I have {new_count}"
+
+
+async def index_channel(context, channel, progress):
+    # Reading the history is REST and stays on the event loop, parsing and
+    # writing each chunk runs in the process pool.
+    bot = context.bot
+    last_indexed = await bot.repository.last_indexed(channel.id)
+    after = Object(id=last_indexed) if last_indexed else None
+    bot.logger.info("Indexing channel '%s' after message %s.", channel, last_indexed)
+    messages = []
+    scanned = 0
+    last_message_id = None
+    async for message in channel.history(limit=None, after=after, oldest_first=True):
+        scanned += 1
+        last_message_id = message.id
+        if message.author != bot.user:
+            messages.append((
+                message.id,
+                message.content,
+                get_votes(message.reactions, UPVOTE),
+                get_votes(message.reactions, DOWNVOTE)
+            ))
+        if scanned == INDEX_CHUNK_SIZE:
+            await write_index_chunk(context, channel, progress, messages, scanned, last_message_id)
+            messages = []
+            scanned = 0
+    if scanned:
+        await write_index_chunk(context, channel, progress, messages, scanned, last_message_id)
+    progress.done.add(channel.name)
+    await progress.update(force=True)
+
+
+async def write_index_chunk(context, channel, progress, messages, scanned, last_message_id):
+    bot = context.bot
+    written = asyncio.ensure_future(context.runner.in_process(
+        index_messages, bot.parser, context.guild.id, channel.id, messages, last_message_id
+    ))
+    try:
+        created, discord_ids = await asyncio.shield(written)
+    except asyncio.CancelledError:
+        # The process commits the chunk anyway, its suggestions have to be
+        # known once it is done, or their reactions get dropped.
+        written.add_done_callback(lambda done: apply_index_chunk(bot, channel, done))
+        raise
+    apply_index_chunk(bot, channel, written)
+    bot.logger.info("Created %s suggestions from %s messages in channel %s.", created, scanned, channel.name)
+    progress.scanned[channel.name] += scanned
+    progress.created[channel.name] += created
+    await progress.update()
+
+
+def apply_index_chunk(bot, channel, written):
+    if written.cancelled() or written.exception() is not None:
+        return
+    created, discord_ids = written.result()
+    for discord_id in discord_ids:
+        bot.known.add(discord_id)
+    if created:
+        bot.leaderboard.invalidate([channel.id])
+
+
+async def run_export(context):
+    # params: files, a list of [name, {channel_id: channel_name}] with one
+    # entry per file, the state (None for all) and its name and the format.
+    params = context.params
+    state_name, fmt = params['state_name'], params['fmt']
+    exported = 0
+    for number, (name, channels) in enumerate(params['files'], start=1):
+        await context.set_progress(f"exporting {name}, file {number} of {len(params['files'])}", force=True)
+        count, parts = await context.runner.in_process(
+            export_files,
+            context.guild.id,
+            {int(channel_id): channel_name for channel_id, channel_name in channels.items()},
+            params['state'],
+            fmt,
+            context.guild.filesize_limit
+        )
+        if not count:
+            context.bot.logger.info("No suggestions found for %s with state %s (None = all states)", name, state_name)
+            await context.send(f"I was not able to find any saved suggestions for '{name}' with the state '{state_name}'.")
+            continue
+        exported += count
+        context.bot.logger.info("Exported %s suggestions for %s with state %s (None = all states) in %s parts", count, name, state_name, len(parts))
+        filename = f"{name}-{state_name}" if state_name else name
+        for part_number, part in enumerate(parts, start=1):
+            part_name = f"-part{part_number}of{len(parts)}" if len(parts) > 1 else ""
+            await context.send(file=File(BytesIO(part), filename=f"{filename}{part_name}.{ENCODERS[fmt].extension}.gz"))
+    return f"Exported {exported} suggestions."
+
+
+async def run_update_votes(context):
+    params = context.params
+    await context.set_progress('recounting votes', force=True)
+    checked, updated = await context.bot.reconciler.reconcile(
+        context.guild, states=params['states'], max_age_days=params['days']
+    )
+    return f"There you go. I checked {checked} suggestions and updated the votes of {updated}."
+
+
+async def rescore_suggestions(repository, guild_id=None, context=None):
+    # Of all guilds if guild_id is None, returns how many were rescored.
+    after_id = updated = 0
+    while True:
+        after_id, count = await repository.rescore(guild_id, after_id, RESCORE_CHUNK_SIZE)
+        if after_id is None:
+            return updated
+        updated += count
+        if context:
+            await context.set_progress(f"rescored {updated} suggestions")
+
+
+async def run_rescore(context):
+    updated = await rescore_suggestions(context.bot.repository, context.guild.id, context)
+    context.bot.leaderboard.invalidate([channel.id for channel in context.bot.registry.watched_channels(context.guild)])
+    return f"Done! Recomputed the {context.bot.ranking} score of {updated} suggestions."
+
+
+JOB_HANDLERS = {
+    'index': run_index,
+    'export': run_export,
+    'update_votes': run_update_votes,
+    'rescore': run_rescore,
+}
+
+
+# Runs the queued jobs as asyncio tasks, at most `workers` at once and at
+# most `per_guild` of the same guild. The REST parts of a job stay on the
+# event loop, CPU and database heavy steps go to a process pool, so large
+# jobs never slow down the handling of reactions and messages.
+class JobRunner:
+
+    def __init__(self, bot, workers=2, per_guild=1, processes=2):
+        self.bot = bot
+        self.logger = bot.logger
+        self.workers = workers
+        self.per_guild = per_guild
+        self.processes = processes
+        self.stopping = False
+        self._contexts = {}
+        self._tasks = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._pool = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def running_in(self, guild_id):
+        return sum(1 for context in self._contexts.values() if context.guild.id == guild_id)
+
+    def progress(self, job_id):
+        # Current progress of a job running here, the database only gets it
+        # every PROGRESS_INTERVAL seconds.
+        context = self._contexts.get(job_id)
+        return context.progress if context else None
+
+    async def in_process(self, func, *args):
+        if self._pool is None:
+            # Spawned, forking a process with an event loop and database
+            # threads is not safe.
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=get_context('spawn'),
+                initializer=init_worker,
+                initargs=(db.database, self.bot.ranking)
+            )
+        with metrics.timer('job_process_seconds', step=func.__name__):
+            return await asyncio.get_running_loop().run_in_executor(self._pool, func, *args)
+
+    async def submit(self, guild_id, kind, params, channel_id=None, author_id=None, unique=False):
+        # Returns None if the job was not queued, see Job.submit.
+        job = await self.bot.repository.submit_job(
+            guild_id, kind, json.dumps(params), channel_id, author_id, unique, MAX_QUEUED_PER_GUILD
+        )
+        if job:
+            self.logger.info('Queued %s job %s for guild %s.', kind, job.id, guild_id)
+            metrics.inc('jobs_total', kind=kind, result='queued')
+            self.wake()
+        return job
+
+    async def cancel(self, guild_id, job_id):
+        # Returns the state the job had, None if it was not queued or running.
+        previous_state = await self.bot.repository.cancel_job(guild_id, job_id)
+        task = self._tasks.get(job_id)
+        if task:
+            task.cancel()
+        return previous_state
+
+    async def cancel_guild(self, guild_id):
+        cancelled = await self.bot.repository.cancel_guild_jobs(guild_id)
+        for job_id, context in list(self._contexts.items()):
+            if context.guild.id == guild_id:
+                self._tasks[job_id].cancel()
+        if cancelled:
+            self.logger.info('Cancelled %s jobs of guild %s.', cancelled, guild_id)
+        return cancelled
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def start(self, loop):
+        requeued = await self.bot.repository.requeue_jobs()
+        if requeued:
+            self.logger.info('Queued %s interrupted jobs again.', requeued)
+        await self.bot.repository.prune_jobs(time.time() - JOB_RETENTION)
+        self._task = loop.create_task(self._run())
+        self.wake()
+
+    async def stop(self):
+        # Running jobs stay running in the database and are queued again on
+        # the next start.
+        self.stopping = True
+        if self.running:
+            self._task.cancel()
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+    async def join(self):
+        # Waits until no job is queued or running, for benchmarks.
+        while self._tasks or await self.bot.repository.queued_jobs(1):
+            await asyncio.sleep(0.05)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                await self._schedule()
+            except Exception as e:
+                self.logger.exception('Could not schedule jobs: %s', e)
+
+    async def _schedule(self):
+        after_id = 0
+        while len(self._tasks) < self.workers:
+            saturated = {
+                context.guild.id for context in self._contexts.values()
+                if self.running_in(context.guild.id) >= self.per_guild
+            }
+            jobs = await self.bot.repository.queued_jobs(SCHEDULE_BATCH, after_id, saturated)
+            if not jobs:
+                return
+            for job in jobs:
+                after_id = job.id
+                if len(self._tasks) >= self.workers:
+                    return
+                if self.running_in(job.guild_id) >= self.per_guild:
+                    continue
+                guild = self.bot.get_guild(job.guild_id)
+                if guild is None:
+                    # Its shard is not ready yet.
+                    continue
+                if not await self.bot.repository.claim_job(job.id):
+                    continue
+                context = JobContext(self, job, guild)
+                self._contexts[job.id] = context
+                self._tasks[job.id] = self.bot.loop.create_task(self._execute(context))
+
+    async def _execute(self, context):
+        job = context.job
+        self.logger.info('Starting %s job %s of %s.', job.kind, job.id, context.guild)
+        started = time.monotonic()
+        try:
+            handler = JOB_HANDLERS.get(job.kind)
+            if handler is None:
+                raise ValueError(f"Unknown job kind '{job.kind}'.")
+            result = await handler(context)
+        except asyncio.CancelledError:
+            self.logger.info('Stopped %s job %s.', job.kind, job.id)
+            if not self.stopping:
+                metrics.inc('jobs_total', kind=job.kind, result='cancelled')
+        except Exception as e:
+            self.logger.exception('The %s job %s failed: %s', job.kind, job.id, e)
+            metrics.inc('jobs_total', kind=job.kind, result='failed')
+            await self.bot.repository.finish_job(job.id, JOB_FAILED, str(e))
+            await context.send(f"I'm sorry, job {job.id} ({job.kind}) failed: {e}")
+        else:
+            self.logger.info('Finished %s job %s: %s', job.kind, job.id, result)
+            metrics.inc('jobs_total', kind=job.kind, result='done')
+            if await self.bot.repository.finish_job(job.id, JOB_DONE, result):
+                await context.send(result)
+        finally:
+            metrics.observe('job_seconds', time.monotonic() - started, kind=job.kind)
+            self._contexts.pop(job.id, None)
+            self._tasks.pop(job.id, None)
+            if not self.stopping:
+                self.wake()
+
+    def stats(self):
+        return {'running': len(self._tasks), 'workers': self.workers, 'per_guild': self.per_guild}
@@ -0,0 +1,88 @@
+import sys
+from array import array
+from bisect import bisect_left
+
+# Pending additions get merged into the sorted array once there are this many.
+MERGE_THRESHOLD = 1024
+
+
+# Membership set of the discord_ids of all saved suggestions. The ids are kept
+# in a sorted array of 64 bit integers (8 bytes per suggestion instead of ~90
+# for a set of ints). New ids go into a small set first and get merged in
+# batches, so adding stays cheap.
+class KnownSuggestions:
+
+    def __init__(self):
+        self.loaded = False
+        self._ids = array('q')
+        self._added = set()
+        self._removed = set()
+
+    def load(self, ids):
+        self._ids = ids
+        self._added = set()
+        self._removed = set()
+        self.loaded = True
+
+    def __len__(self):
+        return len(self._ids) + len(self._added) - len(self._removed)
+
+    def __contains__(self, discord_id):
+        if discord_id in self._added:
+            return True
+        if discord_id in self._removed:
+            return False
+        return self._in_array(discord_id)
+
+    def _in_array(self, discord_id):
+        index = bisect_left(self._ids, discord_id)
+        return index < len(self._ids) and self._ids[index] == discord_id
+
+    def add(self, discord_id):
+        if self._in_array(discord_id):
+            self._removed.discard(discord_id)
+            return
+        self._added.add(discord_id)
+        if len(self._added) >= MERGE_THRESHOLD:
+            self._merge()
+
+    def discard(self, discord_id):
+        self._added.discard(discord_id)
+        if self._in_array(discord_id):
+            self._removed.add(discord_id)
+            if len(self._removed) >= MERGE_THRESHOLD:
+                self._merge()
+
+    def _merge(self):
+        # Copies the array in slices between the changed positions instead of
+        # sorting it, which takes milliseconds even for millions of ids. Added
+        # ids are never in the array, removed ones always are.
+        changes = sorted([(discord_id, True) for discord_id in self._added] + [(discord_id, False) for discord_id in self._removed])
+        merged = array('q')
+        start = 0
+        for discord_id, added in changes:
+            index = bisect_left(self._ids, discord_id, start)
+            merged.extend(self._ids[start:index])
+            if added:
+                merged.append(discord_id)
+                start = index
+            else:
+                start = index + 1
+        merged.extend(self._ids[start:])
+        self._ids = merged
+        self._added = set()
+        self._removed = set()
+
+    def memory_usage(self):
+        return (
+            sys.getsizeof(self._ids)
+            + sys.getsizeof(self._added) + 32 * len(self._added)
+            + sys.getsizeof(self._removed) + 32 * len(self._removed)
+        )
+
+    def stats(self):
+        return {
+            'suggestions': len(self),
+            'pending': len(self._added) + len(self._removed),
+            'bytes': self.memory_usage(),
+        }
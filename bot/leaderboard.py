@@ -0,0 +1,83 @@
+from collections import OrderedDict
+
+from metrics import metrics
+
+from .utils import UPVOTE, DOWNVOTE
+
+SUGGESTIONS_PER_PAGE = 5
+
+# Number of (channel, state) leaderboards kept in memory.
+MAX_CACHED_LEADERBOARDS = 256
+
+
+def render_field(suggestion):
+    return (
+        f"[{suggestion.id}] {suggestion.summary} | **{suggestion.up_votes}x{UPVOTE}** | **{suggestion.down_votes}x{DOWNVOTE}**",
+        f"[Jump to suggestion](https://discordapp.com/channels/{suggestion.guild_id}/{suggestion.channel_id}/{suggestion.discord_id})"
+    )
+
+
+class CachedLeaderboard:
+
+    def __init__(self, count):
+        self.count = count
+        self.pages = {}
+        # cursors[n] is the sort key of the last suggestion on page n.
+        self.cursors = {0: None}
+
+
+# Rendered pages of the show commands per channel and state. Pages are read
+# with keyset pagination, so deep pages cost the same as the first one, and
+# are dropped whenever votes, states or suggestions of the channel change.
+class LeaderboardCache:
+
+    def __init__(self, repository, per_page=SUGGESTIONS_PER_PAGE):
+        self.repository = repository
+        self.per_page = per_page
+        self._leaderboards = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def page(self, channel, state, page):
+        # Returns (count, [(name, value), ...]) of the requested page.
+        key = (channel.id, state)
+        leaderboard = self._leaderboards.get(key)
+        if leaderboard is None:
+            count = await self.repository.leaderboard_count(channel.guild.id, channel.id, state)
+            leaderboard = CachedLeaderboard(count)
+            self._store(key, leaderboard)
+        self._leaderboards.move_to_end(key)
+
+        if page in leaderboard.pages:
+            self.hits += 1
+            metrics.inc('cache_requests_total', cache='leaderboard', result='hit')
+            return leaderboard.count, leaderboard.pages[page]
+        self.misses += 1
+        metrics.inc('cache_requests_total', cache='leaderboard', result='miss')
+        if page < 1 or (page - 1) * self.per_page >= leaderboard.count:
+            return leaderboard.count, []
+
+        # Continue after the closest page before the requested one.
+        known = max(number for number in leaderboard.cursors if number < page)
+        suggestions = await self.repository.leaderboard_after(
+            channel.guild.id, channel.id, state, leaderboard.cursors[known], (page - known) * self.per_page
+        )
+        for offset in range(0, len(suggestions), self.per_page):
+            number = known + 1 + offset // self.per_page
+            page_suggestions = suggestions[offset:offset + self.per_page]
+            leaderboard.pages[number] = [render_field(suggestion) for suggestion in page_suggestions]
+            leaderboard.cursors[number] = (page_suggestions[-1].score, page_suggestions[-1].id)
+        return leaderboard.count, leaderboard.pages.get(page, [])
+
+    def _store(self, key, leaderboard):
+        self._leaderboards[key] = leaderboard
+        while len(self._leaderboards) > MAX_CACHED_LEADERBOARDS:
+            self._leaderboards.popitem(last=False)
+
+    def clear(self):
+        self._leaderboards.clear()
+
+    def invalidate(self, channel_ids):
+        channel_ids = set(channel_ids)
+        for key in [key for key in self._leaderboards if key[0] in channel_ids]:
+            del self._leaderboards[key]
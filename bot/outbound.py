@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import time
+from collections import deque, OrderedDict
+
+import discord
+
+from metrics import metrics
+
+DELETE = 'delete'
+DM = 'dm'
+
+# discord.py already retries rate limited requests a few times, these are
+# the retries after it gave up.
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 1.0
+
+# An identical DM to the same user is not sent again within this window.
+DM_DEDUP_SECONDS = 60
+
+DM_CHANNEL_CACHE_SIZE = 1000
+
+
+class OutboundAction:
+
+    __slots__ = ('kind', 'target', 'content', 'queued', 'attempts')
+
+    def __init__(self, kind, target, content=None):
+        self.kind = kind
+        self.target = target
+        self.content = content
+        self.queued = time.monotonic()
+        self.attempts = 0
+
+    @property
+    def key(self):
+        return (self.target.id, self.content)
+
+
+# Deletions and DMs of declined messages. Event handlers only queue them and
+# a few workers send them, so rate limits never block event processing.
+# Deletes go first, repeated DMs to a user are sent once and DMs are dropped
+# when the queue is full.
+class OutboundQueue:
+
+    def __init__(self, logger, max_size=1000, workers=2, dm_cache_size=DM_CHANNEL_CACHE_SIZE):
+        self.logger = logger
+        self.max_size = max_size
+        self.workers = workers
+        self.dm_cache_size = dm_cache_size
+        self._deletes = deque()
+        self._dms = deque()
+        self._pending_dms = set()
+        self._recent_dms = OrderedDict()
+        self._dm_channels = OrderedDict()
+        self._ready = asyncio.Event()
+        self._busy = 0
+        self._tasks = []
+        self.counts = {'sent': 0, 'dropped': 0, 'deduplicated': 0, 'retried': 0, 'failed': 0}
+
+    def __len__(self):
+        return len(self._deletes) + len(self._dms)
+
+    @property
+    def running(self):
+        return any(not task.done() for task in self._tasks)
+
+    def delete(self, message):
+        if len(self) >= self.max_size and not self._evict_dm():
+            self._count(DELETE, 'dropped')
+            self.logger.throttled('outbound-full', logging.WARNING, 'Outbound queue is full, dropping a delete.')
+            return False
+        self._deletes.append(OutboundAction(DELETE, message))
+        self._queued()
+        return True
+
+    def send_dm(self, user, content):
+        action = OutboundAction(DM, user, content)
+        sent = self._recent_dms.get(action.key)
+        if action.key in self._pending_dms or (sent and action.queued - sent < DM_DEDUP_SECONDS):
+            self._count(DM, 'deduplicated')
+            return False
+        if len(self) >= self.max_size:
+            self._count(DM, 'dropped')
+            self.logger.throttled('outbound-full', logging.WARNING, 'Outbound queue is full, dropping a DM.')
+            return False
+        self._pending_dms.add(action.key)
+        self._dms.append(action)
+        self._queued()
+        return True
+
+    def _evict_dm(self):
+        # Makes room for a delete by dropping the oldest queued DM.
+        if not self._dms:
+            return False
+        action = self._dms.popleft()
+        self._pending_dms.discard(action.key)
+        self._count(DM, 'dropped')
+        self.logger.throttled('outbound-full', logging.WARNING, 'Outbound queue is full, dropping a DM.')
+        return True
+
+    def _queued(self):
+        self._ready.set()
+        self._update_depth()
+
+    def _update_depth(self):
+        metrics.set('outbound_queue_depth', len(self._deletes), action=DELETE)
+        metrics.set('outbound_queue_depth', len(self._dms), action=DM)
+
+    def _count(self, kind, result):
+        self.counts[result] += 1
+        metrics.inc('outbound_actions_total', action=kind, result=result)
+
+    def _next(self):
+        if self._deletes:
+            action = self._deletes.popleft()
+        elif self._dms:
+            action = self._dms.popleft()
+        else:
+            return None
+        if not self:
+            self._ready.clear()
+        self._update_depth()
+        return action
+
+    def start(self, loop):
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=5):
+        # Gives the workers a moment to send what is left.
+        deadline = time.monotonic() + timeout
+        while (self or self._busy) and self.running and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._tasks:
+            task.cancel()
+        if self:
+            self.logger.warning('Dropping %s outbound actions on shutdown.', len(self))
+
+    async def _work(self):
+        while True:
+            await self._ready.wait()
+            action = self._next()
+            if action is None:
+                continue
+            metrics.observe('outbound_wait_seconds', time.monotonic() - action.queued, action=action.kind)
+            self._busy += 1
+            try:
+                await self._send(action)
+            except discord.HTTPException as e:
+                self._failed(action, e)
+            except Exception as e:
+                self.logger.exception('Could not send outbound %s: %s', action.kind, e)
+                self._finish(action, 'failed')
+            else:
+                self._finish(action, 'sent')
+            finally:
+                self._busy -= 1
+
+    async def _send(self, action):
+        if action.kind == DELETE:
+            await action.target.delete()
+            return
+        channel = await self._dm_channel(action.target)
+        try:
+            await channel.send(action.content)
+        except (discord.Forbidden, discord.NotFound):
+            self._dm_channels.pop(action.target.id, None)
+            raise
+
+    async def _dm_channel(self, user):
+        channel = self._dm_channels.get(user.id)
+        if channel is not None:
+            self._dm_channels.move_to_end(user.id)
+            metrics.inc('cache_requests_total', cache='dm_channels', result='hit')
+            return channel
+        metrics.inc('cache_requests_total', cache='dm_channels', result='miss')
+        channel = await user.create_dm()
+        self._dm_channels[user.id] = channel
+        if len(self._dm_channels) > self.dm_cache_size:
+            self._dm_channels.popitem(last=False)
+        return channel
+
+    def _failed(self, action, error):
+        action.attempts += 1
+        if (error.status == 429 or error.status >= 500) and action.attempts < MAX_ATTEMPTS:
+            delay = RETRY_DELAY * 2 ** (action.attempts - 1)
+            self.logger.warning('Outbound %s failed with status %s, retrying in %ss.', action.kind, error.status, delay)
+            self._count(action.kind, 'retried')
+            asyncio.get_running_loop().call_later(delay, self._retry, action)
+            return
+        if action.kind == DELETE and error.status == 404:
+            # Deleted by someone else in the meantime.
+            self._finish(action, 'sent')
+            return
+        self.logger.info('Could not send outbound %s: %s', action.kind, error)
+        self._finish(action, 'failed')
+
+    def _retry(self, action):
+        # Retries skip the size limit, they were accepted already.
+        if action.kind == DELETE:
+            self._deletes.appendleft(action)
+        else:
+            self._dms.appendleft(action)
+        self._queued()
+
+    def _finish(self, action, result):
+        self._count(action.kind, result)
+        if action.kind != DM:
+            return
+        self._pending_dms.discard(action.key)
+        if result == 'sent':
+            self._recent_dms[action.key] = time.monotonic()
+            self._recent_dms.move_to_end(action.key)
+            if len(self._recent_dms) > self.dm_cache_size:
+                self._recent_dms.popitem(last=False)
+
+    def stats(self):
+        return dict(self.counts, deletes=len(self._deletes), dms=len(self._dms), dm_channels=len(self._dm_channels))
@@ -0,0 +1,121 @@
+import asyncio
+import datetime
+import logging
+import math
+
+from discord import NotFound, Forbidden, HTTPException, Object
+from discord.utils import time_snowflake
+
+from .utils import get_votes, UPVOTE, DOWNVOTE
+
+# Messages returned per history request.
+HISTORY_PAGE_SIZE = 100
+
+# Not every message in a watched channel is a suggestion (e.g. pinned or
+# moderator messages), assume up to this many messages per saved suggestion.
+MESSAGES_PER_SUGGESTION = 2
+
+
+class VoteReconciler:
+
+    def __init__(self, bot, concurrency=8, channel_concurrency=2):
+        self.bot = bot
+        self.logger = bot.logger
+        # discord.py already waits for the rate limit bucket of each route,
+        # these only stop us from queueing thousands of requests at once.
+        # Message fetches are bucketed per channel. A single guild gets at
+        # most half of the requests, so other guilds are never starved.
+        self._requests = asyncio.Semaphore(concurrency)
+        self.guild_concurrency = max(1, concurrency // 2)
+        self._guild_requests = {}
+        self.channel_concurrency = channel_concurrency
+
+    async def reconcile(self, guild, states=None, max_age_days=None):
+        min_discord_id = None
+        if max_age_days:
+            since = datetime.datetime.utcnow() - datetime.timedelta(days=max_age_days)
+            min_discord_id = time_snowflake(since)
+        targets = await self.bot.repository.vote_targets(guild.id, states, min_discord_id)
+        self.logger.info('Reconciling votes of %s suggestions in %s channels of %s.', sum(map(len, targets.values())), len(targets), guild)
+
+        results = await asyncio.gather(*[
+            self.reconcile_channel(guild, channel_id, suggestions)
+            for channel_id, suggestions in targets.items()
+        ])
+        self._guild_requests.pop(guild.id, None)
+        checked = sum(channel_checked for channel_checked, _ in results)
+        updated = sum(channel_updated for _, channel_updated in results)
+        await self.bot.votes.flush()
+        self.logger.info('Reconciled votes in %s: checked %s, updated %s.', guild, checked, updated)
+        return checked, updated
+
+    def record(self, channel_id, suggestions, message, counts):
+        # Written to the vote buffer as soon as the message is read, reactions
+        # after that stay deltas on top of it. Waiting for the whole guild
+        # would overwrite the votes cast in the meantime.
+        votes = (get_votes(message.reactions, UPVOTE), get_votes(message.reactions, DOWNVOTE))
+        changed = votes != suggestions[message.id]
+        counts[0] += 1
+        counts[1] += changed
+        # An unchanged recount still replaces the buffered deltas it contains.
+        if changed or self.bot.votes.has_deltas(message.id):
+            self.bot.votes.set(message.id, channel_id, *votes)
+
+    def guild_requests(self, guild):
+        if guild.id not in self._guild_requests:
+            self._guild_requests[guild.id] = asyncio.Semaphore(self.guild_concurrency)
+        return self._guild_requests[guild.id]
+
+    async def reconcile_channel(self, guild, channel_id, suggestions):
+        # Returns how many suggestions were checked and how many updated.
+        channel = guild.get_channel(channel_id)
+        if channel is None:
+            self.logger.info('Channel %s no longer exists, skipping %s suggestions.', channel_id, len(suggestions))
+            return 0, 0
+        first, last = min(suggestions), max(suggestions)
+        in_range = await self.bot.repository.count_in_range(guild.id, channel_id, first, last)
+        history_pages = math.ceil(in_range * MESSAGES_PER_SUGGESTION / HISTORY_PAGE_SIZE)
+        counts = [0, 0]
+        try:
+            if history_pages < len(suggestions):
+                await self.read_history(channel, suggestions, first, last, counts)
+            else:
+                await self.fetch_messages(channel, suggestions, counts)
+        except Forbidden:
+            self.logger.warning('Not allowed to read the messages in %s.', channel)
+        except HTTPException as e:
+            # The suggestions read so far are already recorded.
+            self.logger.warning('Could not read the history of %s: %s', channel, e)
+        return tuple(counts)
+
+    async def read_history(self, channel, suggestions, first, last, counts):
+        self.logger.info('Reading the history of %s for %s suggestions.', channel, len(suggestions))
+        async with self.guild_requests(channel.guild), self._requests:
+            history = channel.history(limit=None, after=Object(id=first - 1), before=Object(id=last + 1), oldest_first=True)
+            async for message in history:
+                if message.id in suggestions:
+                    self.record(channel.id, suggestions, message, counts)
+                    if counts[0] == len(suggestions):
+                        break
+
+    async def fetch_messages(self, channel, suggestions, counts):
+        self.logger.info('Fetching %s suggestions from %s.', len(suggestions), channel)
+        channel_requests = asyncio.Semaphore(self.channel_concurrency)
+        guild_requests = self.guild_requests(channel.guild)
+
+        async def fetch(discord_id):
+            async with channel_requests, guild_requests, self._requests:
+                try:
+                    message = await channel.fetch_message(discord_id)
+                except NotFound:
+                    self.logger.info('Message %s no longer exists.', discord_id)
+                    return
+                except HTTPException as e:
+                    self.logger.throttled(
+                        'reconcile-fetch', logging.WARNING, 'Could not fetch message %s from %s: %s', discord_id, channel, e
+                    )
+                    return
+            self.record(channel.id, suggestions, message, counts)
+
+        await asyncio.gather(*[fetch(discord_id) for discord_id in suggestions])
+
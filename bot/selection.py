@@ -0,0 +1,70 @@
+import datetime
+import operator
+import re
+from functools import reduce
+
+from discord.utils import time_snowflake
+
+from database.models import Suggestion, STATE_NAMES
+
+STATES = {name: state for state, name in STATE_NAMES.items()}
+
+COMPARISONS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '=': operator.eq,
+}
+
+ID_RANGE = re.compile(r'^(?P<first>\d+)-(?P<last>\d+)$')
+VOTES = re.compile(r'^(?P<field>up|down)(?P<comparison><=|>=|<|>|=)(?P<value>\d+)$')
+AGE = re.compile(r'^(?P<field>older|newer):(?P<days>\d+)d?$')
+STATE = re.compile(r'^state:(?P<state>\w+)$')
+
+SELECTION_HELP = (
+    "Suggestions are selected by IDs (12), ID ranges (10-20) and filters: "
+    "state:new, up<3, down>=5 and older:90 / newer:7 (days). "
+    "IDs and ranges add up, filters narrow them down."
+)
+
+
+def age_condition(field, days):
+    since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    if field == 'older':
+        return Suggestion.discord_id < time_snowflake(since)
+    return Suggestion.discord_id >= time_snowflake(since)
+
+
+def parse_selection(guild_id, args):
+    # Turns the arguments of accept/decline/renew into a single condition.
+    # Raises ValueError for arguments that could not be understood.
+    ids = []
+    selected = []
+    filters = [Suggestion.guild_id == guild_id]
+    for arg in args:
+        arg = arg.lower()
+        id_range = ID_RANGE.match(arg)
+        votes = VOTES.match(arg)
+        age = AGE.match(arg)
+        state = STATE.match(arg)
+        if arg.isdigit():
+            ids.append(int(arg))
+        elif id_range:
+            selected.append(Suggestion.id.between(int(id_range.group('first')), int(id_range.group('last'))))
+        elif votes:
+            field = Suggestion.up_votes if votes.group('field') == 'up' else Suggestion.down_votes
+            filters.append(COMPARISONS[votes.group('comparison')](field, int(votes.group('value'))))
+        elif age:
+            filters.append(age_condition(age.group('field'), int(age.group('days'))))
+        elif state and state.group('state') in STATES:
+            filters.append(Suggestion.state == STATES[state.group('state')])
+        else:
+            raise ValueError(arg)
+    if ids:
+        selected.append(Suggestion.id.in_(ids))
+    if not selected and len(filters) == 1:
+        raise ValueError('nothing selected')
+    if selected:
+        filters.append(reduce(operator.or_, selected))
+    return reduce(operator.and_, filters)
@@ -0,0 +1,50 @@
+REASON_FORMAT = 'Incorrect message format.'
+REASON_TOO_LONG = 'Summary is to long.'
+REASON_TOO_SHORT = 'Summary is to short.'
+
+
+# Finds the summary of a suggestion without a regex. It accepts the same
+# messages as the former r'.*\[(?P<summary>.*)\].*' did with re.match: the
+# summary is on the first line, between the last opening bracket that is
+# followed by a closing one and the last closing bracket of that line. Every
+# step is a single scan of the first line, so there is no backtracking.
+class SummaryParser:
+
+    def __init__(self, max_length, min_length=0, brackets='[]'):
+        if len(brackets) % 2:
+            raise ValueError(f"Brackets '{brackets}' need to be an opening and a closing part of the same length.")
+        half = len(brackets) // 2
+        self.opening = brackets[:half]
+        self.closing = brackets[half:]
+        self.max_length = max_length
+        self.min_length = min_length
+
+    def find(self, content):
+        # Returns the (start, end) slice of the summary or None.
+        line_end = content.find('\n')
+        if line_end == -1:
+            line_end = len(content)
+        end = content.rfind(self.closing, 0, line_end)
+        if end == -1:
+            return None
+        start = content.rfind(self.opening, 0, end)
+        if start == -1:
+            return None
+        return start + len(self.opening), end
+
+    def extract(self, content):
+        # The summary regardless of its length, '' if there is none.
+        found = self.find(content)
+        return content[found[0]:found[1]] if found else ''
+
+    def parse(self, content):
+        # Returns (summary, decline_reason), only one of them is set.
+        found = self.find(content)
+        if not found:
+            return None, REASON_FORMAT
+        start, end = found
+        if end - start > self.max_length:
+            return None, REASON_TOO_LONG
+        if end - start < self.min_length:
+            return None, REASON_TOO_SHORT
+        return content[start:end], None
@@ -0,0 +1,39 @@
+from string import Formatter
+
+
+# A str.format template that is parsed once. Unknown fields fail on startup
+# instead of on the first declined message, and fields with a fixed value
+# are rendered into the text right away.
+class MessageTemplate:
+
+    def __init__(self, text, fields, **static):
+        self.formatter = Formatter()
+        self.parts = []
+        literal = ''
+        for text_part, field_name, format_spec, conversion in self.formatter.parse(text):
+            literal += text_part
+            if field_name is None:
+                continue
+            name = field_name.split('.', 1)[0].split('[', 1)[0]
+            if name not in fields and name not in static:
+                raise ValueError(f"Unknown field '{{{field_name}}}' in template, use one of {', '.join(sorted(fields | set(static)))}.")
+            if '{' in format_spec:
+                raise ValueError(f"Nested fields are not supported in '{{{field_name}}}'.")
+            if name in static:
+                literal += self._render_field(field_name, format_spec, conversion, static)
+                continue
+            self.parts.append((literal, field_name, format_spec, conversion))
+            literal = ''
+        self.tail = literal
+
+    def _render_field(self, field_name, format_spec, conversion, values):
+        value, _ = self.formatter.get_field(field_name, (), values)
+        return self.formatter.format_field(self.formatter.convert_field(value, conversion), format_spec)
+
+    def render(self, **values):
+        rendered = []
+        for literal, field_name, format_spec, conversion in self.parts:
+            rendered.append(literal)
+            rendered.append(self._render_field(field_name, format_spec, conversion, values))
+        rendered.append(self.tail)
+        return ''.join(rendered)
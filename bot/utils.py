@@ -2,4 +2,13 @@ UPVOTE = '👍'
 DOWNVOTE = '👎'
 
 def get_votes(reactions, vote_emoji):
-    return sum([x.count for x in reactions if x.emoji == vote_emoji])
\ No newline at end of file
+    return sum([x.count for x in reactions if x.emoji == vote_emoji])
+
+
+def get_vote_deltas(emoji, delta):
+    emoji = str(emoji)
+    if emoji == UPVOTE:
+        return delta, 0
+    if emoji == DOWNVOTE:
+        return 0, delta
+    return 0, 0
@@ -0,0 +1,88 @@
+import asyncio
+
+
+# Reactions only touch this in-memory buffer. The collected votes are written
+# in one transaction every `interval` seconds and once more on `stop()`.
+class VoteBuffer:
+
+    def __init__(self, logger, repository, interval, on_drift=None, on_flush=None):
+        self.logger = logger
+        self.repository = repository
+        self.interval = interval
+        self.on_drift = on_drift
+        self.on_flush = on_flush
+        self._absolute = {}
+        self._deltas = {}
+        self._channels = set()
+        self._task = None
+
+    def __len__(self):
+        return len(self._absolute) + len(self._deltas)
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def add(self, discord_id, channel_id, up_delta, down_delta):
+        self._channels.add(channel_id)
+        up, down = self._deltas.get(discord_id, (0, 0))
+        self._deltas[discord_id] = (up + up_delta, down + down_delta)
+
+    def has_deltas(self, discord_id):
+        return discord_id in self._deltas
+
+    def set(self, discord_id, channel_id, up_votes, down_votes):
+        self._channels.add(channel_id)
+        # A recount already contains every earlier delta of that message.
+        self._deltas.pop(discord_id, None)
+        self._absolute[discord_id] = (up_votes, down_votes)
+
+    async def flush(self):
+        if not self:
+            return []
+        absolute, self._absolute = self._absolute, {}
+        deltas, self._deltas = self._deltas, {}
+        channels, self._channels = self._channels, set()
+        try:
+            drifted = await self.repository.apply_votes(absolute, deltas)
+        except Exception:
+            self._restore(absolute, deltas, channels)
+            raise
+        if self.on_flush:
+            self.on_flush(channels)
+        self.logger.info('Flushed votes of %s messages.', len(set(absolute) | set(deltas)))
+        return drifted
+
+    def _restore(self, absolute, deltas, channels):
+        # Put back a failed flush without overwriting anything newer.
+        self._channels.update(channels)
+        for discord_id, (up_delta, down_delta) in deltas.items():
+            if discord_id not in self._absolute:
+                up, down = self._deltas.get(discord_id, (0, 0))
+                self._deltas[discord_id] = (up + up_delta, down + down_delta)
+        for discord_id, votes in absolute.items():
+            self._absolute.setdefault(discord_id, votes)
+
+    def start(self, loop):
+        self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        if self.running:
+            self._task.cancel()
+        await self._flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._flush()
+
+    async def _flush(self):
+        try:
+            drifted = await self.flush()
+        except Exception as e:
+            self.logger.exception('Could not flush votes: %s', e)
+            return
+        for discord_id, channel_id in drifted:
+            self.logger.warning('Vote drift detected for message %s, refetching votes.', discord_id)
+            if self.on_drift:
+                self.on_drift(discord_id, channel_id)
@@ -0,0 +1,42 @@
+from database import db, DATABASE_PRAGMAS
+from database import ranking
+from database.models import STATE_NEW, IndexCheckpoint
+
+from .export import export_suggestions
+
+# Functions run in the job process pool. They get plain, picklable arguments
+# and open their own connection to the database of the bot.
+
+
+def init_worker(database, algorithm):
+    db.init(database, pragmas=DATABASE_PRAGMAS)
+    ranking.set_algorithm(algorithm)
+
+
+def export_files(guild_id, channels, state, fmt, max_bytes):
+    # Returns the number of exported suggestions and the gzip parts as bytes.
+    with db.connection_context():
+        count, parts = export_suggestions(guild_id, channels, state, fmt, max_bytes)
+    return count, [part.getvalue() for part in parts]
+
+
+def index_messages(parser, guild_id, channel_id, messages, last_message_id):
+    # messages are (discord_id, content, up_votes, down_votes) tuples. Writes
+    # the suggestions among them together with the checkpoint, returns how
+    # many were created and the IDs of all suggestions found.
+    rows = []
+    for discord_id, content, up_votes, down_votes in messages:
+        summary, decline_reason = parser.parse(content)
+        if not decline_reason:
+            rows.append({
+                'guild_id': guild_id,
+                'channel_id': channel_id,
+                'discord_id': discord_id,
+                'up_votes': up_votes,
+                'down_votes': down_votes,
+                'summary': summary,
+                'state': STATE_NEW
+            })
+    with db.connection_context():
+        created = IndexCheckpoint.write_chunk(guild_id, channel_id, rows, last_message_id)
+    return created, [row['discord_id'] for row in rows]
@@ -1,3 +1,10 @@
 from peewee import SqliteDatabase
 
-db = SqliteDatabase('suggestions.db')
+DATABASE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+}
+
+db = SqliteDatabase('suggestions.db', pragmas=DATABASE_PRAGMAS)
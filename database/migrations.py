@@ -0,0 +1,189 @@
+from database import db
+# Registers the suggestion_score SQL function.
+from database import ranking
+
+# The schema version is stored in SQLite's user_version pragma. Migrations
+# must never be edited or reordered once released, only appended.
+
+
+def create_suggestion_table():
+    db.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "suggestion" ('
+        '"id" INTEGER NOT NULL PRIMARY KEY, '
+        '"summary" VARCHAR(255) NOT NULL, '
+        '"discord_id" INTEGER NOT NULL, '
+        '"channel_id" INTEGER NOT NULL, '
+        '"guild_id" INTEGER NOT NULL, '
+        '"state" SMALLINT NOT NULL, '
+        '"up_votes" INTEGER NOT NULL, '
+        '"down_votes" INTEGER NOT NULL)'
+    )
+
+
+def add_suggestion_indexes():
+    # Older versions could save the same message twice, keep the first one.
+    db.execute_sql(
+        'DELETE FROM "suggestion" WHERE "id" NOT IN '
+        '(SELECT MIN("id") FROM "suggestion" GROUP BY "discord_id")'
+    )
+    db.execute_sql('CREATE UNIQUE INDEX IF NOT EXISTS "suggestion_discord_id" ON "suggestion" ("discord_id")')
+    db.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "suggestion_guild_id_channel_id_state_up_votes" '
+        'ON "suggestion" ("guild_id", "channel_id", "state", "up_votes")'
+    )
+
+
+def create_index_checkpoint_table():
+    db.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "indexcheckpoint" ('
+        '"channel_id" INTEGER NOT NULL PRIMARY KEY, '
+        '"guild_id" INTEGER NOT NULL, '
+        '"last_message_id" INTEGER NOT NULL)'
+    )
+
+
+def add_suggestion_score():
+    db.execute_sql('ALTER TABLE "suggestion" ADD COLUMN "score" REAL NOT NULL DEFAULT 0')
+    db.execute_sql('UPDATE "suggestion" SET "score" = suggestion_score("up_votes", "down_votes", "discord_id")')
+    db.execute_sql('DROP INDEX IF EXISTS "suggestion_guild_id_channel_id_state_up_votes"')
+    db.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "suggestion_guild_id_channel_id_state_score" '
+        'ON "suggestion" ("guild_id", "channel_id", "state", "score")'
+    )
+
+
+def create_suggestion_search():
+    # External content FTS5 index over the summaries, the triggers keep it in
+    # sync with every insert, update and delete of a suggestion.
+    db.execute_sql(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS "suggestion_fts" USING fts5('
+        '"summary", content="suggestion", content_rowid="id", tokenize="unicode61 remove_diacritics 2")'
+    )
+    db.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "suggestion_fts_insert" AFTER INSERT ON "suggestion" BEGIN '
+        'INSERT INTO "suggestion_fts" ("rowid", "summary") VALUES (new."id", new."summary"); END'
+    )
+    db.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "suggestion_fts_delete" AFTER DELETE ON "suggestion" BEGIN '
+        'INSERT INTO "suggestion_fts" ("suggestion_fts", "rowid", "summary") VALUES (\'delete\', old."id", old."summary"); END'
+    )
+    db.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "suggestion_fts_update" AFTER UPDATE OF "summary" ON "suggestion" BEGIN '
+        'INSERT INTO "suggestion_fts" ("suggestion_fts", "rowid", "summary") VALUES (\'delete\', old."id", old."summary"); '
+        'INSERT INTO "suggestion_fts" ("rowid", "summary") VALUES (new."id", new."summary"); END'
+    )
+    db.execute_sql('INSERT INTO "suggestion_fts" ("suggestion_fts") VALUES (\'rebuild\')')
+    # Number of suggestions per word, used to find the rare words of a summary.
+    db.execute_sql('CREATE VIRTUAL TABLE IF NOT EXISTS "suggestion_fts_vocab" USING fts5vocab("suggestion_fts", "row")')
+
+
+def add_guild_discord_id_index():
+    # Every query is scoped to a guild, the guild leading indexes keep the
+    # guilds apart like separate tables.
+    db.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "suggestion_guild_id_channel_id_discord_id" '
+        'ON "suggestion" ("guild_id", "channel_id", "discord_id")'
+    )
+
+
+def create_job_table():
+    db.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "job" ('
+        '"id" INTEGER NOT NULL PRIMARY KEY, '
+        '"guild_id" INTEGER NOT NULL, '
+        '"channel_id" INTEGER, '
+        '"author_id" INTEGER, '
+        '"kind" VARCHAR(255) NOT NULL, '
+        '"params" TEXT NOT NULL, '
+        '"state" SMALLINT NOT NULL, '
+        '"progress" VARCHAR(255) NOT NULL, '
+        '"result" TEXT NOT NULL, '
+        '"created_at" REAL NOT NULL, '
+        '"started_at" REAL, '
+        '"finished_at" REAL)'
+    )
+    db.execute_sql('CREATE INDEX IF NOT EXISTS "job_state_id" ON "job" ("state", "id")')
+    db.execute_sql('CREATE INDEX IF NOT EXISTS "job_guild_id_id" ON "job" ("guild_id", "id")')
+
+
+def create_vote_history_tables():
+    db.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "voteevent" ('
+        '"id" INTEGER NOT NULL PRIMARY KEY, '
+        '"discord_id" INTEGER NOT NULL, '
+        '"at" INTEGER NOT NULL, '
+        '"up_delta" INTEGER NOT NULL, '
+        '"down_delta" INTEGER NOT NULL)'
+    )
+    db.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "voterollup" ('
+        '"id" INTEGER NOT NULL PRIMARY KEY, '
+        '"discord_id" INTEGER NOT NULL, '
+        '"guild_id" INTEGER NOT NULL, '
+        '"channel_id" INTEGER NOT NULL, '
+        '"resolution" SMALLINT NOT NULL, '
+        '"bucket" INTEGER NOT NULL, '
+        '"up_votes" INTEGER NOT NULL, '
+        '"down_votes" INTEGER NOT NULL)'
+    )
+    db.execute_sql(
+        'CREATE UNIQUE INDEX IF NOT EXISTS "voterollup_discord_id_resolution_bucket" '
+        'ON "voterollup" ("discord_id", "resolution", "bucket")'
+    )
+    db.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "voterollup_guild_id_resolution_bucket" '
+        'ON "voterollup" ("guild_id", "resolution", "bucket")'
+    )
+    db.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "rollupcheckpoint" ('
+        '"name" VARCHAR(255) NOT NULL PRIMARY KEY, '
+        '"last_event_id" INTEGER NOT NULL)'
+    )
+    # Written in SQLite, so the vote flush, the reconciler and every other
+    # update of the votes are recorded without reading the votes first.
+    db.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "suggestion_vote_event" AFTER UPDATE OF "up_votes", "down_votes" ON "suggestion" '
+        'WHEN old."up_votes" != new."up_votes" OR old."down_votes" != new."down_votes" BEGIN '
+        'INSERT INTO "voteevent" ("discord_id", "at", "up_delta", "down_delta") '
+        'VALUES (new."discord_id", CAST(strftime(\'%s\', \'now\') AS INTEGER), '
+        'new."up_votes" - old."up_votes", new."down_votes" - old."down_votes"); '
+        'END'
+    )
+
+
+def create_setting_table():
+    db.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "setting" ('
+        '"name" VARCHAR(255) NOT NULL PRIMARY KEY, '
+        '"value" TEXT NOT NULL)'
+    )
+
+
+MIGRATIONS = [
+    create_suggestion_table,
+    add_suggestion_indexes,
+    create_index_checkpoint_table,
+    add_suggestion_score,
+    create_suggestion_search,
+    add_guild_discord_id_index,
+    create_job_table,
+    create_vote_history_tables,
+    create_setting_table,
+]
+
+
+def get_version():
+    return db.pragma('user_version')
+
+
+def migrate(logger=None, target=None):
+    target = len(MIGRATIONS) if target is None else target
+    version = get_version()
+    for number in range(version + 1, target + 1):
+        migration = MIGRATIONS[number - 1]
+        if logger:
+            logger.info('Applying database migration %s: %s', number, migration.__name__)
+        with db.atomic():
+            migration()
+            db.pragma('user_version', number)
+    return get_version()
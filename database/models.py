@@ -1,37 +1,404 @@
-from peewee import Model, CharField, IntegerField, SmallIntegerField
+import sqlite3
+import time
+
+from peewee import Model, CharField, IntegerField, SmallIntegerField, FloatField, TextField, Case, fn
 
 from database import db
+from database.ranking import score
 
 STATE_NEW = 0
 STATE_ACCEPTED = 1
 STATE_DECLINED = 2
 
+STATE_NAMES = {
+    STATE_NEW: 'new',
+    STATE_ACCEPTED: 'accepted',
+    STATE_DECLINED: 'declined'
+}
+
+JOB_QUEUED = 0
+JOB_RUNNING = 1
+JOB_DONE = 2
+JOB_FAILED = 3
+JOB_CANCELLED = 4
+
+JOB_STATE_NAMES = {
+    JOB_QUEUED: 'queued',
+    JOB_RUNNING: 'running',
+    JOB_DONE: 'done',
+    JOB_FAILED: 'failed',
+    JOB_CANCELLED: 'cancelled'
+}
+
+JOB_ACTIVE_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+ROLLUP_HOUR = 0
+ROLLUP_DAY = 1
+
+ROLLUP_SECONDS = {
+    ROLLUP_HOUR: 3600,
+    ROLLUP_DAY: 86400
+}
+
+# UPDATE ... RETURNING needs SQLite 3.35.
+SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Stay well below SQLITE_MAX_VARIABLE_NUMBER, a CASE uses two variables per row.
+BULK_CHUNK_SIZE = 200
+
+
+def chunked(items, size=BULK_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
 class Suggestion(Model):
     summary = CharField()
-    discord_id = IntegerField()
+    discord_id = IntegerField(unique=True)
     channel_id = IntegerField()
     guild_id = IntegerField()
     state =  SmallIntegerField(default=STATE_NEW)
     up_votes = IntegerField(default=0)
     down_votes = IntegerField(default=0)
+    score = FloatField(default=0.0)
+
+    class Meta:
+        database = db
+        indexes = (
+            (('guild_id', 'channel_id', 'state', 'score'), False),
+            (('guild_id', 'channel_id', 'discord_id'), False),
+        )
+
+    @classmethod
+    def transition(cls, state, condition):
+        # Sets the state of all suggestions matching condition in a single
+        # statement, returns (id, channel_id) of the updated suggestions.
+        with db.atomic('IMMEDIATE'):
+            query = cls.update(state=state).where(condition)
+            if SUPPORTS_RETURNING:
+                return list(query.returning(cls.id, cls.channel_id).tuples().execute())
+            updated = list(cls.select(cls.id, cls.channel_id).where(condition).tuples())
+            query.execute()
+            return updated
+
+    @classmethod
+    def rescore(cls, guild_id, after_id, limit):
+        # Recomputes the score of the next `limit` suggestions after after_id,
+        # of all guilds if guild_id is None. Returns the ID of the last one and
+        # how many were updated, (None, 0) when there are none left.
+        query = cls.select(cls.id).where(cls.id > after_id).order_by(cls.id).limit(limit)
+        if guild_id is not None:
+            query = query.where(cls.guild_id == guild_id)
+        ids = [suggestion_id for suggestion_id, in query.tuples()]
+        if not ids:
+            return None, 0
+        query = cls.update(score=fn.suggestion_score(cls.up_votes, cls.down_votes, cls.discord_id)).where(
+            cls.id > after_id, cls.id <= ids[-1]
+        )
+        if guild_id is not None:
+            query = query.where(cls.guild_id == guild_id)
+        query.execute()
+        return ids[-1], len(ids)
+
+    @classmethod
+    def apply_votes(cls, absolute, deltas):
+        # absolute maps discord_id -> (up_votes, down_votes) and overwrites the
+        # stored votes, deltas maps discord_id -> (up_delta, down_delta) and is
+        # added on top. Returns (discord_id, channel_id) of every suggestion
+        # that ended up with negative votes, those got clamped to 0.
+        changed = set(absolute) | set(deltas)
+        drifted = []
+        with db.atomic():
+            for chunk in chunked(absolute.items()):
+                up_votes = Case(cls.discord_id, [(discord_id, votes[0]) for discord_id, votes in chunk])
+                down_votes = Case(cls.discord_id, [(discord_id, votes[1]) for discord_id, votes in chunk])
+                cls.update(
+                    up_votes=up_votes,
+                    down_votes=down_votes,
+                    score=fn.suggestion_score(up_votes, down_votes, cls.discord_id)
+                ).where(cls.discord_id.in_([discord_id for discord_id, _ in chunk])).execute()
+            for chunk in chunked(deltas.items()):
+                up_votes = cls.up_votes + Case(cls.discord_id, [(discord_id, votes[0]) for discord_id, votes in chunk], 0)
+                down_votes = cls.down_votes + Case(cls.discord_id, [(discord_id, votes[1]) for discord_id, votes in chunk], 0)
+                cls.update(
+                    up_votes=up_votes,
+                    down_votes=down_votes,
+                    score=fn.suggestion_score(up_votes, down_votes, cls.discord_id)
+                ).where(cls.discord_id.in_([discord_id for discord_id, _ in chunk])).execute()
+            for chunk in chunked(changed):
+                drifted.extend(
+                    cls.select(cls.discord_id, cls.channel_id).where(
+                        cls.discord_id.in_(chunk),
+                        (cls.up_votes < 0) | (cls.down_votes < 0)
+                    ).tuples()
+                )
+            for chunk in chunked(drifted):
+                up_votes = fn.MAX(cls.up_votes, 0)
+                down_votes = fn.MAX(cls.down_votes, 0)
+                cls.update(
+                    up_votes=up_votes,
+                    down_votes=down_votes,
+                    score=fn.suggestion_score(up_votes, down_votes, cls.discord_id)
+                ).where(cls.discord_id.in_([discord_id for discord_id, _ in chunk])).execute()
+        return drifted
+
+    @classmethod
+    def insert_new(cls, rows):
+        # Inserts all rows whose message is not saved yet, returns how many.
+        created = 0
+        for row in rows:
+            row['score'] = score(row['up_votes'], row['down_votes'], row['discord_id'])
+        for chunk in chunked(rows, BULK_CHUNK_SIZE // 4):
+            created += db.execute(cls.insert_many(chunk).on_conflict_ignore()).rowcount
+        return created
+
+
+class IndexCheckpoint(Model):
+    channel_id = IntegerField(primary_key=True)
+    guild_id = IntegerField()
+    last_message_id = IntegerField()
+
+    class Meta:
+        database = db
+
+    @classmethod
+    def last_indexed(cls, channel_id):
+        checkpoint = cls.get_or_none(cls.channel_id == channel_id)
+        return checkpoint.last_message_id if checkpoint else None
+
+    @classmethod
+    def advance(cls, guild_id, channel_id, last_message_id):
+        cls.insert(
+            channel_id=channel_id,
+            guild_id=guild_id,
+            last_message_id=last_message_id
+        ).on_conflict_replace().execute()
+
+    @classmethod
+    def write_chunk(cls, guild_id, channel_id, rows, last_message_id):
+        # The checkpoint only moves together with the rows before it, so an
+        # interrupted indexing continues right after the last written chunk.
+        with db.atomic():
+            created = Suggestion.insert_new(rows)
+            cls.advance(guild_id, channel_id, last_message_id)
+        return created
+
+
+# Maintenance work (indexing, exports, recounting votes) queued by commands.
+# Jobs survive restarts, running ones are queued again on startup.
+class Job(Model):
+    guild_id = IntegerField()
+    channel_id = IntegerField(null=True)
+    author_id = IntegerField(null=True)
+    kind = CharField()
+    params = TextField(default='{}')
+    state = SmallIntegerField(default=JOB_QUEUED)
+    progress = CharField(default='')
+    result = TextField(default='')
+    created_at = FloatField(default=time.time)
+    started_at = FloatField(null=True)
+    finished_at = FloatField(null=True)
+
+    class Meta:
+        database = db
+        indexes = (
+            (('state', 'id'), False),
+            (('guild_id', 'id'), False),
+        )
+
+    @classmethod
+    def submit(cls, guild_id, kind, params, channel_id=None, author_id=None, unique=False, max_queued=None):
+        # With unique, no job is created while the guild already has an
+        # active job of that kind, neither while it has max_queued queued
+        # jobs. Returns None then.
+        with db.atomic('IMMEDIATE'):
+            if unique and cls.select().where(
+                cls.guild_id == guild_id, cls.kind == kind, cls.state.in_(JOB_ACTIVE_STATES)
+            ).exists():
+                return None
+            if max_queued is not None and cls.select().where(
+                cls.guild_id == guild_id, cls.state == JOB_QUEUED
+            ).count() >= max_queued:
+                return None
+            return cls.create(guild_id=guild_id, kind=kind, params=params, channel_id=channel_id, author_id=author_id)
+
+    @classmethod
+    def queued(cls, limit, after_id=0, exclude_guilds=()):
+        # The oldest queued job of every guild not in exclude_guilds, oldest
+        # first, so a guild with many queued jobs never holds up the others.
+        first = cls.select(fn.MIN(cls.id)).where(cls.state == JOB_QUEUED)
+        if exclude_guilds:
+            first = first.where(cls.guild_id.not_in(list(exclude_guilds)))
+        first = first.group_by(cls.guild_id)
+        return list(cls.select().where(cls.id.in_(first), cls.id > after_id).order_by(cls.id).limit(limit))
+
+    @classmethod
+    def claim(cls, job_id):
+        # Only one runner can move a job from queued to running.
+        return cls.update(state=JOB_RUNNING, started_at=time.time()).where(
+            cls.id == job_id, cls.state == JOB_QUEUED
+        ).execute() == 1
+
+    @classmethod
+    def set_progress(cls, job_id, progress):
+        cls.update(progress=progress).where(cls.id == job_id).execute()
+
+    @classmethod
+    def finish(cls, job_id, state, result):
+        # A cancelled job stays cancelled, even if it finished in the meantime.
+        return cls.update(state=state, result=result, finished_at=time.time()).where(
+            cls.id == job_id, cls.state == JOB_RUNNING
+        ).execute() == 1
+
+    @classmethod
+    def cancel(cls, guild_id, job_id):
+        # Returns the state the job had before, None if it was not active.
+        with db.atomic('IMMEDIATE'):
+            job = cls.get_or_none(cls.id == job_id, cls.guild_id == guild_id, cls.state.in_(JOB_ACTIVE_STATES))
+            if job is None:
+                return None
+            cls.update(state=JOB_CANCELLED, result='Cancelled.', finished_at=time.time()).where(cls.id == job_id).execute()
+            return job.state
+
+    @classmethod
+    def cancel_guild(cls, guild_id):
+        # Returns how many queued or running jobs of the guild were cancelled.
+        return cls.update(state=JOB_CANCELLED, result='The bot left the server.', finished_at=time.time()).where(
+            cls.guild_id == guild_id, cls.state.in_(JOB_ACTIVE_STATES)
+        ).execute()
+
+    @classmethod
+    def requeue_running(cls):
+        # Jobs interrupted by a restart. Index jobs continue at their
+        # checkpoints, the others start over.
+        return cls.update(state=JOB_QUEUED, started_at=None).where(cls.state == JOB_RUNNING).execute()
+
+    @classmethod
+    def prune(cls, before):
+        return cls.delete().where(cls.state.not_in(JOB_ACTIVE_STATES), cls.finished_at < before).execute()
+
+    @classmethod
+    def recent(cls, guild_id, limit):
+        return list(cls.select().where(cls.guild_id == guild_id).order_by(cls.id.desc()).limit(limit))
+
+
+# Append-only log of vote changes, written by a trigger on every update of
+# the votes of a suggestion. Compacted into VoteRollup and deleted after the
+# retention period.
+class VoteEvent(Model):
+    discord_id = IntegerField()
+    at = IntegerField()
+    up_delta = IntegerField()
+    down_delta = IntegerField()
+
+    class Meta:
+        database = db
+
+
+# Votes gained per suggestion and hour or day.
+class VoteRollup(Model):
+    discord_id = IntegerField()
+    guild_id = IntegerField()
+    channel_id = IntegerField()
+    resolution = SmallIntegerField()
+    bucket = IntegerField()
+    up_votes = IntegerField()
+    down_votes = IntegerField()
 
     class Meta:
         database = db
+        indexes = (
+            (('discord_id', 'resolution', 'bucket'), True),
+            (('guild_id', 'resolution', 'bucket'), False),
+        )
 
-    def update_state(self, state):
-        self.state = state
-        self.save()
+    @classmethod
+    def compact(cls, now, event_retention, retention):
+        # Adds all events since the last compaction to the hourly and daily
+        # rollups, then deletes events and rollups older than their
+        # retention (seconds, per resolution). Events are never changed, so
+        # the checkpoint is simply the last compacted event ID.
+        with db.atomic('IMMEDIATE'):
+            last_id = RollupCheckpoint.last_id('votes')
+            until_id = VoteEvent.select(fn.MAX(VoteEvent.id)).scalar() or last_id
+            if until_id > last_id:
+                for resolution, seconds in ROLLUP_SECONDS.items():
+                    db.execute_sql(
+                        'INSERT INTO "voterollup" ("discord_id", "guild_id", "channel_id", "resolution", "bucket", "up_votes", "down_votes") '
+                        'SELECT "e"."discord_id", "s"."guild_id", "s"."channel_id", ?, "e"."at" - "e"."at" % ?, '
+                        'SUM("e"."up_delta"), SUM("e"."down_delta") '
+                        'FROM "voteevent" AS "e" JOIN "suggestion" AS "s" ON "s"."discord_id" = "e"."discord_id" '
+                        'WHERE "e"."id" > ? AND "e"."id" <= ? '
+                        'GROUP BY "e"."discord_id", "e"."at" - "e"."at" % ? '
+                        'ON CONFLICT ("discord_id", "resolution", "bucket") DO UPDATE SET '
+                        '"up_votes" = "up_votes" + excluded."up_votes", "down_votes" = "down_votes" + excluded."down_votes"',
+                        (resolution, seconds, last_id, until_id, seconds)
+                    )
+                RollupCheckpoint.advance('votes', until_id)
 
-    def accept(self):
-        self.update_state(STATE_ACCEPTED)
+            # Events are ordered by time, everything before the first one
+            # still in the retention period can go, if it was compacted.
+            first_kept = VoteEvent.select(VoteEvent.id).where(
+                VoteEvent.at >= now - event_retention
+            ).order_by(VoteEvent.id).limit(1).scalar()
+            limit = min(first_kept, until_id + 1) if first_kept else until_id + 1
+            deleted = VoteEvent.delete().where(VoteEvent.id < limit).execute()
+            for resolution, seconds in retention.items():
+                deleted += cls.delete().where(cls.resolution == resolution, cls.bucket < now - seconds).execute()
+        return until_id - last_id, deleted
 
-    def decline(self):
-        self.update_state(STATE_DECLINED)
+    @classmethod
+    def trending(cls, guild_id, resolution, since, state, limit):
+        # Returns [(suggestion, up_votes, down_votes), ...] of the suggestions
+        # with the most net votes gained since `since`.
+        gained_up = fn.SUM(cls.up_votes)
+        gained_down = fn.SUM(cls.down_votes)
+        query = Suggestion.select(
+            Suggestion, gained_up.alias('gained_up'), gained_down.alias('gained_down')
+        ).join(cls, on=(cls.discord_id == Suggestion.discord_id)).where(
+            cls.guild_id == guild_id,
+            cls.resolution == resolution,
+            cls.bucket >= since
+        )
+        if state is not None:
+            query = query.where(Suggestion.state == state)
+        query = query.group_by(Suggestion.id).having(gained_up - gained_down > 0)
+        query = query.order_by((gained_up - gained_down).desc(), Suggestion.id.desc()).limit(limit)
+        return [(suggestion, suggestion.gained_up, suggestion.gained_down) for suggestion in query]
+
+
+class RollupCheckpoint(Model):
+    name = CharField(primary_key=True)
+    last_event_id = IntegerField()
+
+    class Meta:
+        database = db
+
+    @classmethod
+    def last_id(cls, name):
+        checkpoint = cls.get_or_none(cls.name == name)
+        return checkpoint.last_event_id if checkpoint else 0
+
+    @classmethod
+    def advance(cls, name, last_event_id):
+        cls.insert(name=name, last_event_id=last_event_id).on_conflict_replace().execute()
+
+
+# State of the bot that has to survive restarts, e.g. the ranking algorithm
+# the stored scores were computed with.
+class Setting(Model):
+    name = CharField(primary_key=True)
+    value = TextField()
+
+    class Meta:
+        database = db
 
-    def renew(self):
-        self.update_state(STATE_NEW)
+    @classmethod
+    def get_value(cls, name):
+        setting = cls.get_or_none(cls.name == name)
+        return setting.value if setting else None
 
-    def set_votes(self, upvote, downvote):
-        self.up_votes = upvote
-        self.down_votes = downvote
-        self.save()
+    @classmethod
+    def set_value(cls, name, value):
+        cls.insert(name=name, value=value).on_conflict_replace().execute()
@@ -0,0 +1,66 @@
+import math
+
+from database import db
+
+# Discord snowflakes count milliseconds since 2015-01-01.
+DISCORD_EPOCH = 1420070400000
+
+# z-score for a 95% confidence interval.
+WILSON_Z = 1.96
+
+# Seconds after which a suggestion needs ten times the votes to rank the same.
+HOT_DECAY = 45000
+
+
+def created_at(discord_id):
+    # Seconds since the discord epoch.
+    return (discord_id >> 22) / 1000
+
+
+def net(up_votes, down_votes, discord_id):
+    return float(up_votes - down_votes)
+
+
+def wilson(up_votes, down_votes, discord_id):
+    total = up_votes + down_votes
+    if not total:
+        return 0.0
+    positive = up_votes / total
+    z = WILSON_Z
+    return (
+        positive + z * z / (2 * total)
+        - z * math.sqrt((positive * (1 - positive) + z * z / (4 * total)) / total)
+    ) / (1 + z * z / total)
+
+
+def hot(up_votes, down_votes, discord_id):
+    net_votes = up_votes - down_votes
+    order = math.log10(max(abs(net_votes), 1))
+    sign = (net_votes > 0) - (net_votes < 0)
+    return round(sign * order + created_at(discord_id) / HOT_DECAY, 7)
+
+
+ALGORITHMS = {
+    'net': net,
+    'wilson': wilson,
+    'hot': hot,
+}
+
+DEFAULT_ALGORITHM = 'wilson'
+
+algorithm = ALGORITHMS[DEFAULT_ALGORITHM]
+
+
+def set_algorithm(name):
+    global algorithm
+    algorithm = ALGORITHMS[name]
+
+
+def score(up_votes, down_votes, discord_id):
+    # Bulk delta updates can see negative votes before they get clamped.
+    return algorithm(max(up_votes, 0), max(down_votes, 0), discord_id)
+
+
+# Lets bulk updates recompute the score inside SQLite, e.g.
+# fn.suggestion_score(Suggestion.up_votes, Suggestion.down_votes, Suggestion.discord_id)
+db.register_function(score, 'suggestion_score', 3)
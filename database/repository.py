@@ -0,0 +1,296 @@
+import asyncio
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from peewee import Tuple
+
+from database import db
+from metrics import metrics
+from database.models import Suggestion, IndexCheckpoint, Job, VoteRollup, Setting
+from database.ranking import score
+from database.search import words, search_query, candidates_query, prefix_size, similarity, DUPLICATE_CANDIDATES
+
+SLOW_WAIT = 0.25
+
+
+class WaitStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    def record(self, waited, ran):
+        with self._lock:
+            self.calls += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.run_total += ran
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'wait_avg': self.wait_total / self.calls if self.calls else 0.0,
+                'wait_max': self.wait_max,
+                'run_avg': self.run_total / self.calls if self.calls else 0.0,
+            }
+
+
+# All peewee access of the bot goes through this class, so no query ever runs
+# on the event loop. Writes are serialized on a single thread, reads are
+# spread over a small pool. The job processes write through their own
+# connections, so a transaction that reads before it writes has to start
+# with BEGIN IMMEDIATE. Otherwise SQLite fails its first write with "database
+# is locked" instead of waiting, if another connection committed in between.
+class Repository:
+
+    def __init__(self, logger, readers=2):
+        self.logger = logger
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+        self.write_stats = WaitStats()
+        self.read_stats = WaitStats()
+
+    async def write(self, func, *args, **kwargs):
+        return await self._run(self._writer, self.write_stats, 'write', func, *args, **kwargs)
+
+    async def read(self, func, *args, **kwargs):
+        return await self._run(self._readers, self.read_stats, 'read', func, *args, **kwargs)
+
+    async def _run(self, executor, stats, pool, func, *args, **kwargs):
+        queued = time.perf_counter()
+
+        def call():
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                finished = time.perf_counter()
+                stats.record(started - queued, finished - started)
+                metrics.observe('db_wait_seconds', started - queued, pool=pool)
+                metrics.observe('db_query_seconds', finished - started, query=func.__name__.lstrip('_'))
+                if started - queued > SLOW_WAIT:
+                    self.logger.warning('Waited %.3fs for the database to run %s.', started - queued, func.__name__)
+
+        return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+    def stats(self):
+        return {'write': self.write_stats.as_dict(), 'read': self.read_stats.as_dict()}
+
+    def close(self):
+        self.logger.info('Database wait times: %s', self.stats())
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+
+    async def suggestion_ids(self):
+        return await self.read(_suggestion_ids)
+
+    async def rescore(self, guild_id, after_id, limit):
+        return await self.write(Suggestion.rescore, guild_id, after_id, limit)
+
+    async def setting(self, name):
+        return await self.read(Setting.get_value, name)
+
+    async def set_setting(self, name, value):
+        return await self.write(Setting.set_value, name, value)
+
+    async def suggestion_exists(self, discord_id):
+        return await self.read(_suggestion_exists, discord_id)
+
+    async def create_suggestion(self, **fields):
+        return await self.write(_create_suggestion, **fields)
+
+    async def apply_votes(self, absolute, deltas):
+        return await self.write(Suggestion.apply_votes, absolute, deltas)
+
+    async def change_state(self, condition, state):
+        return await self.write(Suggestion.transition, state, condition)
+
+    async def leaderboard_count(self, guild_id, channel_id, state):
+        return await self.read(_leaderboard_count, guild_id, channel_id, state)
+
+    async def leaderboard_after(self, guild_id, channel_id, state, cursor, limit):
+        return await self.read(_leaderboard_after, guild_id, channel_id, state, cursor, limit)
+
+    async def last_indexed(self, channel_id):
+        return await self.read(IndexCheckpoint.last_indexed, channel_id)
+
+    async def vote_targets(self, guild_id, states=None, min_discord_id=None):
+        return await self.read(_vote_targets, guild_id, states, min_discord_id)
+
+    async def count_in_range(self, guild_id, channel_id, first, last):
+        return await self.read(_count_in_range, guild_id, channel_id, first, last)
+
+    async def count(self, **filters):
+        return await self.read(_count, **filters)
+
+    async def submit_job(self, guild_id, kind, params, channel_id=None, author_id=None, unique=False, max_queued=None):
+        return await self.write(Job.submit, guild_id, kind, params, channel_id, author_id, unique, max_queued)
+
+    async def queued_jobs(self, limit, after_id=0, exclude_guilds=()):
+        return await self.read(Job.queued, limit, after_id, exclude_guilds)
+
+    async def claim_job(self, job_id):
+        return await self.write(Job.claim, job_id)
+
+    async def set_job_progress(self, job_id, progress):
+        return await self.write(Job.set_progress, job_id, progress)
+
+    async def finish_job(self, job_id, state, result):
+        return await self.write(Job.finish, job_id, state, result)
+
+    async def cancel_job(self, guild_id, job_id):
+        return await self.write(Job.cancel, guild_id, job_id)
+
+    async def cancel_guild_jobs(self, guild_id):
+        return await self.write(Job.cancel_guild, guild_id)
+
+    async def requeue_jobs(self):
+        return await self.write(Job.requeue_running)
+
+    async def prune_jobs(self, before):
+        return await self.write(Job.prune, before)
+
+    async def recent_jobs(self, guild_id, limit):
+        return await self.read(Job.recent, guild_id, limit)
+
+    async def job(self, guild_id, job_id):
+        return await self.read(Job.get_or_none, Job.id == job_id, Job.guild_id == guild_id)
+
+    async def compact_votes(self, now, event_retention, retention):
+        return await self.write(VoteRollup.compact, now, event_retention, retention)
+
+    async def trending(self, guild_id, resolution, since, state, limit):
+        return await self.read(VoteRollup.trending, guild_id, resolution, since, state, limit)
+
+    async def search(self, guild_id, text, state=None, limit=10):
+        return await self.read(_search, guild_id, search_query(text), state, limit)
+
+    async def duplicates(self, suggestion, threshold):
+        return await self.read(_duplicates, suggestion, threshold)
+
+
+def _suggestion_ids():
+    # Sorted by the unique index, ready for KnownSuggestions.
+    query = Suggestion.select(Suggestion.discord_id).order_by(Suggestion.discord_id)
+    return array('q', (discord_id for discord_id, in query.tuples().iterator()))
+
+
+def _suggestion_exists(discord_id):
+    return Suggestion.select().where(Suggestion.discord_id == discord_id).exists()
+
+
+def _create_suggestion(**fields):
+    # A single statement, the unique index on discord_id skips a message that
+    # is already saved, e.g. by an index job. Returns None then.
+    suggestion = Suggestion(**fields)
+    suggestion.score = score(suggestion.up_votes, suggestion.down_votes, suggestion.discord_id)
+    cursor = db.execute(Suggestion.insert(suggestion.__data__).on_conflict_ignore())
+    if cursor.rowcount != 1:
+        return None
+    suggestion.id = cursor.lastrowid
+    return suggestion
+
+
+def _leaderboard_query(guild_id, channel_id, state):
+    return Suggestion.select().where(
+        Suggestion.guild_id == guild_id,
+        Suggestion.channel_id == channel_id,
+        Suggestion.state == state
+    )
+
+
+def _leaderboard_count(guild_id, channel_id, state):
+    return _leaderboard_query(guild_id, channel_id, state).count()
+
+
+def _leaderboard_after(guild_id, channel_id, state, cursor, limit):
+    # Keyset pagination, cursor is the (score, id) of the last suggestion of
+    # the previous page.
+    query = _leaderboard_query(guild_id, channel_id, state)
+    if cursor:
+        query = query.where(Tuple(Suggestion.score, Suggestion.id) < Tuple(*cursor))
+    return list(query.order_by(Suggestion.score.desc(), Suggestion.id.desc()).limit(limit))
+
+
+def _vote_targets(guild_id, states, min_discord_id):
+    # Returns {channel_id: {discord_id: (up_votes, down_votes)}}.
+    query = Suggestion.select(
+        Suggestion.channel_id, Suggestion.discord_id, Suggestion.up_votes, Suggestion.down_votes
+    ).where(Suggestion.guild_id == guild_id)
+    if states:
+        query = query.where(Suggestion.state.in_(states))
+    if min_discord_id:
+        query = query.where(Suggestion.discord_id >= min_discord_id)
+    targets = {}
+    for channel_id, discord_id, up_votes, down_votes in query.tuples().iterator():
+        targets.setdefault(channel_id, {})[discord_id] = (up_votes, down_votes)
+    return targets
+
+
+def _count_in_range(guild_id, channel_id, first, last):
+    return Suggestion.select().where(
+        Suggestion.guild_id == guild_id,
+        Suggestion.channel_id == channel_id,
+        Suggestion.discord_id.between(first, last)
+    ).count()
+
+
+def _count(**filters):
+    return Suggestion.filter(**filters).count()
+
+
+def _match(guild_id, query, state, limit):
+    # Best matches first, by FTS5's bm25 rank.
+    sql = (
+        'SELECT "suggestion".* FROM "suggestion_fts" '
+        'JOIN "suggestion" ON "suggestion"."id" = "suggestion_fts"."rowid" '
+        'WHERE "suggestion_fts" MATCH ? AND "suggestion"."guild_id" = ?'
+    )
+    params = [query, guild_id]
+    if state is not None:
+        sql += ' AND "suggestion"."state" = ?'
+        params.append(state)
+    sql += ' ORDER BY "suggestion_fts"."rank" LIMIT ?'
+    params.append(limit)
+    return list(Suggestion.raw(sql, *params))
+
+
+def _search(guild_id, query, state, limit):
+    if not query:
+        return []
+    return _match(guild_id, query, state, limit)
+
+
+def _document_frequencies(summary_words):
+    cursor = db.execute_sql(
+        'SELECT "term", "doc" FROM "suggestion_fts_vocab" WHERE "term" IN (%s)' % ', '.join('?' * len(summary_words)),
+        list(summary_words)
+    )
+    return dict(cursor.fetchall())
+
+
+def _duplicates(suggestion, threshold):
+    # Returns [(similarity, suggestion), ...] of the other suggestions of the
+    # guild at least `threshold` similar, most similar first. Only suggestions
+    # sharing one of the rarest words are candidates, so this never scans
+    # the table.
+    summary_words = set(words(suggestion.summary))
+    if not summary_words:
+        return []
+    frequencies = _document_frequencies(summary_words)
+    rarest = sorted(summary_words, key=lambda word: (frequencies.get(word, 0), word))
+    query = candidates_query(rarest[:prefix_size(len(summary_words), threshold)])
+    duplicates = []
+    for candidate in _match(suggestion.guild_id, query, None, DUPLICATE_CANDIDATES + 1):
+        if candidate.id == suggestion.id:
+            continue
+        candidate_similarity = similarity(summary_words, set(words(candidate.summary)))
+        if candidate_similarity >= threshold:
+            duplicates.append((candidate_similarity, candidate))
+    return sorted(duplicates, key=lambda duplicate: duplicate[0], reverse=True)
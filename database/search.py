@@ -0,0 +1,42 @@
+import math
+import re
+
+WORD = re.compile(r'\w+')
+
+# Candidates fetched from the full-text index for the duplicate check.
+DUPLICATE_CANDIDATES = 20
+
+
+def words(text):
+    return WORD.findall(text.lower())
+
+
+# FTS5 queries are built out of the words of the text only, so quotes and
+# operators in user input can never be a syntax error.
+
+def search_query(text):
+    # Suggestions containing all words, the last one may be incomplete.
+    terms = [f'"{word}"' for word in words(text)]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def candidates_query(candidate_words):
+    # Suggestions containing any of the words.
+    return ' OR '.join(f'"{word}"' for word in candidate_words)
+
+
+def prefix_size(word_count, threshold):
+    # Two word sets with a Jaccard similarity of at least `threshold` share
+    # at least ceil(threshold * word_count) words, so any this many words of
+    # a summary contain at least one word of every similar summary. Querying
+    # only the rarest ones keeps the candidates few.
+    return max(1, word_count - math.ceil(threshold * word_count) + 1)
+
+
+def similarity(first, second):
+    # Jaccard similarity of two word sets.
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
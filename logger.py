@@ -1,6 +1,18 @@
 import os
 import sys
+import atexit
+import time
+import queue
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+
+class DeferredQueueHandler(QueueHandler):
+
+    def prepare(self, record):
+        # The listener runs in the same process, so the record can be passed
+        # as it is and gets formatted on the listener thread instead.
+        return record
 
 
 class BotLogger:
@@ -10,16 +22,49 @@ class BotLogger:
 
         log_level = os.getenv('LOG_LEVEL', 'DEBUG')
         log_file = os.getenv('LOG_FILE')
+        log_queue = os.getenv('LOG_QUEUE', 'true').lower() in ('1', 'true', 'yes')
+        self._rate_limit = float(os.getenv('LOG_RATE_LIMIT', 10))
+        self._throttled = {}
 
         self._logger.setLevel(logging._nameToLevel[log_level])
 
         if log_file:
-            self._log_handler = logging.FileHandler(filename=log_file, encoding='utf-8', mode='w')
+            rotate_when = os.getenv('LOG_ROTATE_WHEN')
+            backup_count = int(os.getenv('LOG_BACKUP_COUNT', 5))
+            if rotate_when:
+                self._log_handler = TimedRotatingFileHandler(
+                    filename=log_file, when=rotate_when, backupCount=backup_count, encoding='utf-8'
+                )
+            else:
+                self._log_handler = RotatingFileHandler(
+                    filename=log_file,
+                    maxBytes=int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+                    backupCount=backup_count,
+                    encoding='utf-8'
+                )
         else:
             self._log_handler = logging.StreamHandler(sys.stdout)
 
         self._log_handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-        self._logger.addHandler(self._log_handler)
+
+        self._listener = None
+        if log_queue:
+            # Handlers do their (file) I/O on the listener thread, so logging
+            # never blocks the event loop.
+            log_records = queue.SimpleQueue()
+            self._listener = QueueListener(log_records, self._log_handler)
+            self._listener.start()
+            self._logger.addHandler(DeferredQueueHandler(log_records))
+            # Also writes the queued records on sys.exit and uncaught errors.
+            atexit.register(self.stop)
+        else:
+            self._logger.addHandler(self._log_handler)
+
+    def stop(self):
+        # Writes all queued records, the logger must not be used afterwards.
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
 
     def debug(self, msg, *args, **kwargs):
         self._logger.debug(msg, *args, **kwargs)
@@ -38,3 +83,19 @@ class BotLogger:
 
     def exception(self, msg, *args, **kwargs):
         self._logger.exception(msg, *args, **kwargs)
+
+    def throttled(self, key, level, msg, *args):
+        # For high volume lines: logs at most one message per key every
+        # LOG_RATE_LIMIT seconds and counts the suppressed ones.
+        if not self._logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        last, suppressed = self._throttled.get(key, (0, 0))
+        if now - last < self._rate_limit:
+            self._throttled[key] = (last, suppressed + 1)
+            return
+        self._throttled[key] = (now, 0)
+        if suppressed:
+            msg = f'{msg} (%s similar messages suppressed)'
+            args = args + (suppressed,)
+        self._logger.log(level, msg, *args)
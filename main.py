@@ -3,7 +3,9 @@ import os
 from dotenv import load_dotenv
 from discord import Intents
 
-from bot import SuggestionBot
+from bot import SuggestionBot, ShardedSuggestionBot
+from database import db
+from database.migrations import migrate
 from logger import BotLogger
 from bot.commands import COMMANDS
 
@@ -13,7 +15,17 @@ if __name__ == '__main__':
     DISCORD_BOT_TOKEN = os.getenv('DISCORD_BOT_TOKEN')
     logger = BotLogger()
     logger.debug('Before instantiation of SuggestionBot')
-    bot = SuggestionBot(logger, command_prefix="/")
+    if os.getenv('SHARDED', '').lower() in ('1', 'true', 'yes'):
+        shard_count = os.getenv('SHARD_COUNT')
+        logger.info('Starting with %s shards.', shard_count or 'the recommended number of')
+        bot = ShardedSuggestionBot(logger, command_prefix="/", shard_count=int(shard_count) if shard_count else None)
+    else:
+        bot = SuggestionBot(logger, command_prefix="/")
+    with db:
+        migrate(logger)
     bot.logger.debug('Starting SuggestionBot bot now')
     [bot.add_command(command) for command in COMMANDS]
-    bot.run(DISCORD_BOT_TOKEN)
+    try:
+        bot.run(DISCORD_BOT_TOKEN)
+    finally:
+        logger.stop()
@@ -0,0 +1,236 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds in seconds of the latency histogram buckets.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def render_labels(key, **extra):
+    labels = dict(key, **extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket the quantile falls into.
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class NoTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class Timer:
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+NO_TIMER = NoTimer()
+
+
+# Counters and latency histograms of the bot. Everything is a no-op while
+# disabled, so the instrumentation can stay in the hot paths.
+class Metrics:
+
+    def __init__(self):
+        self.enabled = False
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = label_key(labels)
+        with self._lock:
+            values = self.counters.setdefault(name, {})
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = label_key(labels)
+        with self._lock:
+            self.gauges.setdefault(name, {})[key] = value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = label_key(labels)
+        with self._lock:
+            histograms = self.histograms.setdefault(name, {})
+            if key not in histograms:
+                histograms[key] = Histogram()
+            histograms[key].observe(seconds)
+
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return NO_TIMER
+        return Timer(self, name, labels)
+
+    def timed(self, name, **labels):
+        # Decorator for coroutines and plain functions.
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return await func(*args, **kwargs)
+                    with Timer(self, name, labels):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with Timer(self, name, labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render(self):
+        # Prometheus text exposition format.
+        lines = []
+        with self._lock:
+            for name, values in sorted(self.counters.items()):
+                lines.append(f'# TYPE suggestionbot_{name} counter')
+                for key, value in values.items():
+                    lines.append(f'suggestionbot_{name}{render_labels(key)} {value}')
+            for name, values in sorted(self.gauges.items()):
+                lines.append(f'# TYPE suggestionbot_{name} gauge')
+                for key, value in values.items():
+                    lines.append(f'suggestionbot_{name}{render_labels(key)} {value}')
+            for name, histograms in sorted(self.histograms.items()):
+                lines.append(f'# TYPE suggestionbot_{name} histogram')
+                for key, histogram in histograms.items():
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'suggestionbot_{name}_bucket{render_labels(key, le=bound)} {cumulative}')
+                    lines.append(f'suggestionbot_{name}_sum{render_labels(key)} {histogram.sum}')
+                    lines.append(f'suggestionbot_{name}_count{render_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        # Short human readable overview for the stats command.
+        uptime = max(time.time() - self.started, 1)
+        lines = [f'Uptime: {uptime / 3600:.1f}h']
+        with self._lock:
+            for name, histograms in sorted(self.histograms.items()):
+                for key, histogram in sorted(histograms.items()):
+                    lines.append(
+                        f'{name}{render_labels(key)}: {histogram.count} ({histogram.count / uptime:.2f}/s), '
+                        f'p50 <= {histogram.quantile(0.5) * 1000:g}ms, p99 <= {histogram.quantile(0.99) * 1000:g}ms'
+                    )
+            for name, values in sorted(self.counters.items()) + sorted(self.gauges.items()):
+                for key, value in sorted(values.items()):
+                    lines.append(f'{name}{render_labels(key)}: {value}')
+        return lines
+
+
+class RateLimitHandler(logging.Handler):
+    # discord.py only reports its rate limit waits in its log.
+
+    def __init__(self, metrics):
+        super().__init__(logging.WARNING)
+        self.metrics = metrics
+
+    def emit(self, record):
+        if record.msg.startswith('We are being rate limited'):
+            self.metrics.observe('rate_limit_wait_seconds', record.args[0])
+
+
+async def serve(host, port, logger):
+    # Minimal HTTP endpoint for Prometheus, answers every request with the metrics.
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+            body = metrics.render().encode('utf-8')
+            writer.write(
+                b'HTTP/1.1 200 OK\r\n'
+                b'Content-Type: text/plain; version=0.0.4\r\n'
+                + f'Content-Length: {len(body)}\r\n'.encode('ascii')
+                + b'Connection: close\r\n\r\n'
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host=host, port=port)
+    logger.info('Serving metrics on %s:%s.', host, port)
+    return server
+
+
+def write_file(path):
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as metrics_file:
+        metrics_file.write(metrics.render())
+    os.replace(temporary_path, path)
+
+
+async def dump(path, interval, logger):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, write_file, path)
+        except OSError as e:
+            logger.warning('Could not write metrics to %s: %s', path, e)
+
+
+metrics = Metrics()
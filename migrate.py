@@ -0,0 +1,8 @@
+from database import db
+from database.migrations import migrate, get_version
+
+
+if __name__ == '__main__':
+    with db:
+        print(f"Database is at version {get_version()}, migrating...")
+        print(f"... done! Database is at version {migrate()}.")